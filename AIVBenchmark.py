@@ -0,0 +1,311 @@
+import json
+import time
+
+import numpy as np
+
+SIZES = ('small', 'medium', 'production')
+X0 = [7000, 10, 10, 0, 0, 0, 0, 0, 1e3, 1e3]
+OM = 2*np.pi/365
+
+
+def _avian_rhs(size):
+    '''Single-state Avian() calls, as made by odeint().'''
+    from AIVDynamics import Avian
+
+    n = {'small': 10**3, 'medium': 10**4, 'production': 10**5}[size]
+    X = np.array(X0, dtype = float)
+    t = np.linspace(0, 365, n)
+
+    def run():
+        for tt in t:
+            Avian(X, tt, 0.06, 3.6, 10, 5, OM, 0)
+        return n
+    return run
+
+
+def _dynamics(size):
+    '''DynamicsSolver() over 1, 10 and 50 years of daily output, without plotting.'''
+    from AIVDynamics import DynamicsSolver
+
+    years = {'small': 1, 'medium': 10, 'production': 50}[size]
+    t = np.arange(0, 365*years + 1, 1.0)
+
+    def run():
+        res, info = DynamicsSolver(X0, t, 0.06, 3.6, 10, 5, OM, 0, plot = False,
+                                   full_output = True)
+        return info['nfev']
+    return run
+
+
+def _heatmap(size):
+    '''
+    An (a, b, fit) grid like those of the heatmap scripts, through
+    R0_calc.R0Grid(), with a and b on the scale of Viral().
+    '''
+    from R0_calc import R0Grid
+
+    n = {'small': 101, 'medium': 401, 'production': 1001}[size]
+    a = np.linspace(0.01, 0.2, n)[:, None, None]
+    b = np.linspace(1, 5, n)[None, :, None]
+    fit = np.linspace(0, 100, 5)[None, None, :]
+
+    def run():
+        R0Grid(a, b, fit)
+        return n*n*5
+    return run
+
+
+def _r0(size):
+    '''
+    R0_calc.R0() over daily time arrays of 1, 10 and 100 years: R0Components()
+    and the figure R0() draws, built on a Figure with its own Agg canvas, so
+    the matplotlib backend of the caller is left alone.
+    '''
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    from AIVDynamics import Temp
+    from R0_calc import R0Components
+
+    years = {'small': 1, 'medium': 10, 'production': 100}[size]
+    t = np.arange(0, 365*years, 1.0)
+
+    def run():
+        A, B, R0 = R0Components(t, 0.06, 3.6, 5.73, 1.91, 92.3, OM)
+        current_temp = Temp(t, 5.73, 1.91, OM, 92.3)
+        fig = Figure(figsize = (10, 8))
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        ax.plot(current_temp, A, color = 'b', label = '$R_0$ for LPAI')
+        ax.plot(current_temp, B, color = 'r', label = '$R_0$ for HPAI')
+        ax.plot(current_temp, R0, color = 'black', alpha = 0.6,
+                label = '$R_0$ for coexisting environment')
+        ax.legend()
+        return len(t)
+    return run
+
+
+def _counted_system(counter):
+    '''RiTwoStrain.system() whose V(t) counts its evaluations.'''
+    import RiTwoStrain
+
+    original = RiTwoStrain.system
+
+    def system(**params):
+        V_t, F_t, period = original(**params)
+
+        def counted(t):
+            counter[0] += 1
+            return V_t(t)
+        return counted, F_t, period
+    return original, system
+
+
+def _ri_monodromy(size):
+    '''RiTwoStrain.monodromy() solves at 1, 4 and 16 values of theta.'''
+    import RiTwoStrain
+
+    thetas = np.linspace(1, 5, {'small': 1, 'medium': 4, 'production': 16}[size])
+
+    def run():
+        counter = [0]
+        original, RiTwoStrain.system = _counted_system(counter)
+        try:
+            for theta in thetas:
+                RiTwoStrain.monodromy(theta)
+        finally:
+            RiTwoStrain.system = original
+        return counter[0]
+    return run
+
+
+def _ri_bisection(size):
+    '''RiTwoStrain.find_theta() by bisection to tolerances 1e-2, 1e-4 and 1e-6.'''
+    import RiTwoStrain
+
+    tol = {'small': 1e-2, 'medium': 1e-4, 'production': 1e-6}[size]
+
+    def run():
+        counter = [0]
+        original, RiTwoStrain.system = _counted_system(counter)
+        try:
+            RiTwoStrain.find_theta(tol = tol, method = 'bisect')
+        finally:
+            RiTwoStrain.system = original
+        return counter[0]
+    return run
+
+
+# name: (setup(size) -> run() -> number of model evaluations, what is counted)
+CASES = {'avian_rhs': (_avian_rhs, 'Avian() calls'),
+         'dynamics': (_dynamics, 'right-hand side evaluations'),
+         'heatmap': (_heatmap, 'grid points'),
+         'r0': (_r0, 'time points'),
+         'ri_monodromy': (_ri_monodromy, 'V(t) evaluations'),
+         'ri_bisection': (_ri_bisection, 'V(t) evaluations')}
+
+
+def _environment():
+    import platform
+    import scipy
+
+    return {'python': platform.python_version(), 'numpy': np.__version__,
+            'scipy': scipy.__version__, 'machine': platform.machine(),
+            'processor': platform.processor(), 'system': platform.system(),
+            'date': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+def RunBenchmarks(cases = None, sizes = ('small', 'medium'), repeat = 3, output = None,
+                  verbose = True):
+    '''
+    This function times the hot paths of the project. Every case is set up
+    once per size, run once to warm up imports and caches, once under
+    tracemalloc for its peak memory and then `repeat` times for the wall time.
+    Everything runs locally on the CPU.
+    Parameters
+    ----------
+    cases : list of str, optional
+        Names from CASES. The default (None) runs all of them.
+    sizes : list of str
+        Any of 'small', 'medium' and 'production'. The default is small and medium.
+    repeat : int
+        Number of timed runs; the median is reported. The default is 3.
+    output : str, optional
+        Path of a JSON file to write the results to, e.g. a baseline.
+    verbose : bool
+        Print every result as it is measured. The default is True.
+
+    Returns
+    -------
+    results : dict
+        'environment' (versions, machine, date) and 'results', which holds for
+        every case and size the median 'time' in seconds, all 'times', the
+        number of model 'evaluations' and the 'peak_memory' in bytes.
+    '''
+    import tracemalloc
+
+    cases = list(CASES) if cases is None else list(cases)
+    for name in cases:
+        if name not in CASES:
+            raise ValueError(f"Unknown case {name!r}, expected one of {list(CASES)}.")
+    for size in sizes:
+        if size not in SIZES:
+            raise ValueError(f"Unknown size {size!r}, expected one of {SIZES}.")
+
+    results = {}
+    for name in cases:
+        setup, counted = CASES[name]
+        results[name] = {}
+        for size in sizes:
+            run = setup(size)
+            run()
+            tracemalloc.start()
+            evaluations = run()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                run()
+                times.append(time.perf_counter() - start)
+
+            results[name][size] = {'time': float(np.median(times)), 'times': times,
+                                   'evaluations': evaluations, 'peak_memory': peak}
+            if verbose:
+                print(f"{name:14s} {size:10s} {np.median(times):10.4f} s "
+                      f"{peak/2**20:10.1f} MiB {evaluations:>12d} {counted}")
+
+    report = {'environment': _environment(), 'results': results}
+    if output is not None:
+        with open(output, 'w') as file:
+            json.dump(report, file, indent = 2)
+    return report
+
+
+def CompareBenchmarks(baseline, current, threshold = 0.2, min_time = 0.01, verbose = True):
+    '''
+    This function compares two benchmark reports and flags regressions: a
+    wall time or peak memory, or a number of model evaluations, that grew by
+    more than threshold (relative) over the baseline. Times must also grow by
+    more than min_time, so that timer noise on very short cases is not
+    flagged. Only cases and sizes present in both are compared.
+    Parameters
+    ----------
+    baseline, current : dict or str
+        Reports of RunBenchmarks() or paths of their JSON files.
+    threshold : scalar
+        Allowed relative increase. The default is 0.2 (20 %).
+    min_time : scalar
+        Smallest increase of a wall time in seconds that counts. The default is 0.01.
+    verbose : bool
+        Print the comparison. The default is True.
+
+    Returns
+    -------
+    regressions : list of dict
+        One entry per regression with the case, size, metric, baseline and
+        current values and their ratio. Empty if nothing regressed.
+    '''
+    reports = []
+    for report in (baseline, current):
+        if isinstance(report, str):
+            with open(report) as file:
+                report = json.load(file)
+        reports.append(report['results'])
+    old, new = reports
+
+    regressions = []
+    for name in old:
+        for size in old[name]:
+            if size not in new.get(name, {}):
+                continue
+            for metric in ('time', 'peak_memory', 'evaluations'):
+                before, after = old[name][size][metric], new[name][size][metric]
+                ratio = after/before if before else (np.inf if after else 1.0)
+                flagged = ratio > 1 + threshold and (metric != 'time' or after - before > min_time)
+                if flagged:
+                    regressions.append({'case': name, 'size': size, 'metric': metric,
+                                        'baseline': before, 'current': after, 'ratio': ratio})
+                if verbose:
+                    print(f"{name:14s} {size:10s} {metric:12s} {before:14.6g} {after:14.6g} "
+                          f"{ratio:8.2f}x{'  REGRESSION' if flagged else ''}")
+    return regressions
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description = "Benchmarks of the avian influenza model.")
+    sub = parser.add_subparsers(dest = 'command', required = True)
+
+    run = sub.add_parser('run', help = "run the benchmarks and save a baseline")
+    run.add_argument('--cases', nargs = '+', choices = list(CASES))
+    run.add_argument('--sizes', nargs = '+', choices = SIZES, default = ['small', 'medium'])
+    run.add_argument('--repeat', type = int, default = 3)
+    run.add_argument('--output', default = 'benchmark_baseline.json')
+
+    compare = sub.add_parser('compare', help = "rerun the benchmarks of a baseline and compare")
+    compare.add_argument('baseline')
+    compare.add_argument('current', nargs = '?',
+                         help = "saved report to compare instead of running the benchmarks")
+    compare.add_argument('--threshold', type = float, default = 0.2)
+    compare.add_argument('--min-time', type = float, default = 0.01)
+    compare.add_argument('--repeat', type = int, default = 3)
+    compare.add_argument('--output', help = "also save the new report")
+
+    options = parser.parse_args()
+    if options.command == 'run':
+        RunBenchmarks(options.cases, options.sizes, options.repeat, options.output)
+    else:
+        current = options.current
+        if current is None:
+            with open(options.baseline) as file:
+                old = json.load(file)['results']
+            sizes = [size for size in SIZES if any(size in old[name] for name in old)]
+            current = RunBenchmarks([name for name in old if name in CASES], sizes,
+                                    options.repeat, options.output)
+        regressions = CompareBenchmarks(options.baseline, current, options.threshold,
+                                        options.min_time)
+        print(f"{len(regressions)} regression(s) above {options.threshold:.0%}.")
+        sys.exit(1 if regressions else 0)
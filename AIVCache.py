@@ -0,0 +1,165 @@
+import hashlib
+import inspect
+import json
+import os
+import uuid
+
+import numpy as np
+
+import AIVDynamics
+import AIVTemperature
+from AIVDynamics import DynamicsSolver
+
+_code_version = None
+
+
+def CodeVersion():
+    '''
+    Hash of the sources of the modules a solve runs: AIVDynamics.py and
+    AIVTemperature.py (for temp = TemperatureSeries). It is part of every
+    cache key, so cached trajectories are not reused after the model code
+    changes.
+    '''
+    global _code_version
+    if _code_version is None:
+        h = hashlib.sha256()
+        for module in (AIVDynamics, AIVTemperature):
+            with open(module.__file__, 'rb') as fh:
+                h.update(hashlib.sha256(fh.read()).digest())
+        _code_version = h.hexdigest()
+    return _code_version
+
+
+def _array_digest(x):
+    x = np.ascontiguousarray(x, dtype = float)
+    return hashlib.sha256(str(x.shape).encode() + x.tobytes()).hexdigest()
+
+
+def _canonical(name, v):
+    '''
+    JSON-able value of a parameter for the key: strings, booleans and None as
+    they are, numbers as floats, arrays and temperature series by a hash of
+    their contents.
+    '''
+    if v is None or isinstance(v, (str, bool, np.bool_)):
+        return v.item() if isinstance(v, np.bool_) else v
+    if np.isscalar(v) or (isinstance(v, np.ndarray) and v.ndim == 0):
+        return float(v)
+    if isinstance(v, (list, tuple, np.ndarray)):
+        return {'array': _array_digest(v)}
+    if all(hasattr(v, k) for k in ('values', 't0', 'dt', 'periodic')):
+        # an AIVTemperature.TemperatureSeries
+        return {'series': _array_digest(v.values), 't0': float(v.t0), 'dt': float(v.dt),
+                'periodic': bool(v.periodic)}
+    raise ValueError(f"Cannot build a cache key from {name} = {v!r}; only numbers, strings, "
+                     f"arrays and TemperatureSeries can be hashed.")
+
+
+def _defaults():
+    '''Default options of DynamicsSolver() and parameters of Avian().'''
+    params = {}
+    for func in (AIVDynamics.Avian, DynamicsSolver):
+        for k, p in inspect.signature(func).parameters.items():
+            if p.default is not inspect.Parameter.empty and k not in ('plot', 'full_output'):
+                params[k] = p.default
+    return params
+
+
+def CacheKey(X0, t, a, b, T0, epsilon, om, fi, **kwargs):
+    '''
+    Canonical hash of the inputs of DynamicsSolver() and the code version.
+    Options and parameters left out are filled in with their defaults, arrays
+    are hashed by their float64 bytes and parameters by the JSON of their
+    float values with sorted names, so equal inputs give equal keys
+    regardless of their Python types, keyword order or whether defaults are
+    passed explicitly. Temperature series are hashed by their contents.
+    '''
+    h = hashlib.sha256()
+    h.update(CodeVersion().encode())
+    h.update(np.ascontiguousarray(X0, dtype = float).tobytes())
+    h.update(np.ascontiguousarray(t, dtype = float).tobytes())
+    params = {**_defaults(), 'a': a, 'b': b, 'T0': T0, 'epsilon': epsilon, 'om': om, 'fi': fi,
+              **kwargs}
+    h.update(json.dumps({k: _canonical(k, v) for k, v in params.items()},
+                        sort_keys = True).encode())
+    return h.hexdigest()
+
+
+def _evict(cache_dir, max_bytes):
+    '''
+    Delete the least recently used entries until the cache fits in max_bytes.
+    Other processes may evict at the same time, so missing files are skipped.
+    '''
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith('.npy'):
+            continue
+        try:
+            st = os.stat(os.path.join(cache_dir, name))
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime, st.st_size, name))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def CachedSolver(X0, t, a, b, T0, epsilon, om, fi, cache_dir = '.aiv_cache',
+                 max_bytes = 2**30, **kwargs):
+    '''
+    This function returns the solution of DynamicsSolver() (without plotting)
+    from a persistent on-disk cache, and solves and stores it on a miss.
+    Entries are .npy files named by CacheKey() and returned as read-only
+    memory maps. A hit marks its entry as recently used; when the cache grows
+    beyond max_bytes the least recently used entries are deleted. New entries
+    are written to a unique temporary file and renamed into place, so any
+    number of processes can read and write the same cache concurrently and
+    never see a partial entry.
+    Parameters
+    ----------
+    X0, t, a, b, T0, epsilon, om, fi :
+        Same as in DynamicsSolver().
+    cache_dir : str
+        Cache directory, created if needed. The default is '.aiv_cache'.
+    max_bytes : int
+        Size limit of the cache. The default is 1 GiB.
+    **kwargs : optional
+        Options of DynamicsSolver() (method, jac) and additional parameters to
+        pass to Avian(). They are part of the key.
+
+    Returns
+    -------
+    Solution: array
+        Read-only memory map of the solution (shape len(t) x 10).
+    '''
+    os.makedirs(cache_dir, exist_ok = True)
+    path = os.path.join(cache_dir, CacheKey(X0, t, a, b, T0, epsilon, om, fi, **kwargs) + '.npy')
+
+    try:
+        res = np.load(path, mmap_mode = 'r')
+        os.utime(path)
+        return res
+    except FileNotFoundError:
+        pass
+
+    res = DynamicsSolver(X0, t, a, b, T0, epsilon, om, fi, plot = False, **kwargs)
+
+    tmp = os.path.join(cache_dir, f".{uuid.uuid4().hex}.tmp")
+    with open(tmp, 'wb') as fh:
+        np.save(fh, res)
+    os.replace(tmp, path)
+
+    _evict(cache_dir, max_bytes)
+
+    try:
+        return np.load(path, mmap_mode = 'r')
+    except FileNotFoundError:
+        # evicted right away by a tiny max_bytes or another process
+        return res
@@ -0,0 +1,292 @@
+import numpy as np
+
+from AIVDynamics import Avian, PeriodicOrbit, SensitivitySolver
+
+ARGS = ('a', 'b', 'T0', 'epsilon', 'om', 'fi')
+HPAI = (2, 5)          # I2, I12
+DEATHS = (2, 5, 3)     # HPAI deaths d2*(I2 + I12 + R1)
+
+
+def _default(name):
+    import inspect
+
+    return inspect.signature(Avian).parameters[name].default
+
+
+def LogLikelihood(y, mu, dispersion = None):
+    '''
+    Log-likelihood of counts y with means mu and its derivative with respect
+    to mu, elementwise.
+    Parameters
+    ----------
+    y : array
+        Observed counts.
+    mu : array
+        Model means.
+    dispersion : scalar, optional
+        Size k of the negative binomial distribution (variance mu + mu**2/k).
+        The default (None) is the Poisson distribution.
+
+    Returns
+    -------
+    Log-likelihood and its derivative, arrays of the shape of y
+    '''
+    from scipy.special import gammaln
+
+    y = np.asarray(y, dtype = float)
+    mu = np.maximum(mu, 1e-12)
+    if dispersion is None:
+        return y*np.log(mu) - mu - gammaln(y + 1), y/mu - 1
+    k = dispersion
+    ll = (gammaln(y + k) - gammaln(k) - gammaln(y + 1)
+          + k*np.log(k/(k + mu)) + y*np.log(mu/(k + mu)))
+    return ll, y/mu - (y + k)/(k + mu)
+
+
+def _grid(t_obs, dt):
+    '''
+    Solution grid with at most dt between points that contains the
+    observation times, their positions in it and the trapezoid weights that
+    integrate a function on the grid over each observation interval.
+    '''
+    pieces = [t_obs[:1]]
+    for t1, t2 in zip(t_obs[:-1], t_obs[1:]):
+        n = max(int(np.ceil((t2 - t1)/dt - 1e-9)), 1)
+        pieces.append(np.linspace(t1, t2, n + 1)[1:])
+    grid = np.concatenate(pieces)
+    obs = np.searchsorted(grid, t_obs)
+
+    W = np.zeros((len(t_obs) - 1, len(grid)))
+    for i in range(len(t_obs) - 1):
+        h = np.diff(grid[obs[i]:obs[i + 1] + 1])
+        W[i, obs[i]:obs[i + 1]] += h/2
+        W[i, obs[i] + 1:obs[i + 1] + 1] += h/2
+    return grid, obs, W
+
+
+class _Objective:
+    '''
+    Negative log-likelihood of the surveillance data and its gradient with
+    respect to the logarithms of the fitted parameters. With periodic = True
+    the seasonal cycle is searched from the cycle of the nearest parameters
+    evaluated so far, so a far trial point of a line search cannot move later
+    evaluations onto another attractor.
+    '''
+
+    def __init__(self, setup):
+        (self.t_obs, self.prevalence, self.deaths, self.X0, self.fixed, self.names,
+         self.periodic, self.transient, self.dispersion, self.sampling, self.reporting,
+         self.dt, self.rtol, self.atol) = setup
+        self.grid, self.obs, self.W = _grid(self.t_obs, self.dt)
+        self.cycles = []     # (log-parameters, state on the cycle at t_obs[0])
+        self.last = None
+        self.nfev = 0
+
+    def params(self, z):
+        values = dict(self.fixed, **dict(zip(self.names, np.exp(z))))
+        return tuple(values.pop(k) for k in ARGS), values
+
+    def start(self, z, args, kwargs):
+        '''Initial state and its sensitivities dX0/dp.'''
+        k = len(self.names)
+        if not self.periodic:
+            return np.asarray(self.X0, dtype = float), np.zeros((10, k))
+
+        a, b, T0, epsilon, om, fi = args
+        t0 = self.t_obs[0]
+        period = 2*np.pi/om
+        if self.cycles:
+            # warm start, which converges in a few Newton steps, so give up early otherwise
+            X, n = min(self.cycles, key = lambda c: np.sum((c[0] - z)**2))[1], 0
+        else:
+            X, n = self.X0, self.transient
+        orbit, mult, info = PeriodicOrbit(X, *args, t0 = t0, n_points = 2, n_transient = n,
+                                          max_iter = 10, full_output = True, **kwargs)
+        self.cycles.append((z, orbit[0]))
+        # a fixed point X0 = P(X0, p) moves with p as dX0/dp = (I - M)^-1 dP/dp
+        res, S = SensitivitySolver(orbit[0], [t0, t0 + period], *args, params = self.names,
+                                   rtol = self.rtol, atol = self.atol, **kwargs)
+        return orbit[0], np.linalg.solve(np.eye(10) - info['monodromy'], S[-1])
+
+    def __call__(self, z):
+        if self.last is not None and np.array_equal(z, self.last[0]):
+            return self.last[1]
+        theta = np.exp(z)
+        args, kwargs = self.params(z)
+        self.nfev += 1
+        try:
+            X0, S0 = self.start(z, args, kwargs)
+            res, S = SensitivitySolver(X0, self.grid, *args, params = self.names,
+                                       rtol = self.rtol, atol = self.atol, S0 = S0, **kwargs)
+        except (RuntimeError, np.linalg.LinAlgError):
+            # a failed solve gets a large finite value, so the line search steps back
+            return 1e10, np.zeros_like(z)
+
+        f, g = 0.0, np.zeros(len(z))
+        if self.prevalence is not None:
+            mu = self.sampling*res[self.obs][:, HPAI].sum(axis = 1)
+            dmu = self.sampling*S[self.obs][:, HPAI].sum(axis = 1)
+            ll, dll = LogLikelihood(self.prevalence, mu, self.dispersion)
+            f -= ll.sum()
+            g -= dll @ dmu
+
+        if self.deaths is not None:
+            d2 = kwargs.get('d2', _default('d2'))
+            D = d2*res[:, DEATHS].sum(axis = 1)
+            dD = d2*S[:, DEATHS].sum(axis = 1)
+            if 'd2' in self.names:
+                dD[:, self.names.index('d2')] += res[:, DEATHS].sum(axis = 1)
+            mu = self.reporting*(self.W @ D)
+            dmu = self.reporting*(self.W @ dD)
+            ll, dll = LogLikelihood(self.deaths, mu, self.dispersion)
+            f -= ll.sum()
+            g -= dll @ dmu
+
+        self.last = (np.copy(z), (f, g*theta))
+        return f, g*theta
+
+
+def _fit(z0, bounds, setup, max_iter, first_step):
+    '''
+    One L-BFGS-B run from z0; returns the result as a dict.
+    The first step of L-BFGS-B is the gradient itself within bounds and has
+    unit length without, so the log-parameters are divided by first_step and
+    the objective by first_step times its initial gradient norm: both make
+    the first step first_step long.
+    '''
+    from scipy.optimize import minimize
+
+    objective = _Objective(setup)
+    f0, g0 = objective(z0)
+    if f0 >= 1e10:
+        return {'z': z0, 'loglik': -np.inf, 'success': False, 'nit': 0, 'nfev': objective.nfev,
+                'message': "The model cannot be solved at the starting values."}
+    scale = first_step*max(np.linalg.norm(g0), 1e-12)
+
+    def scaled(u):
+        f, g = objective(u*first_step)
+        return f/scale, g*first_step/scale
+
+    sol = minimize(scaled, z0/first_step, jac = True, method = 'L-BFGS-B',
+                   bounds = np.asarray(bounds)/first_step, options = {'maxiter': max_iter})
+    return {'z': sol.x*first_step, 'loglik': -sol.fun*scale, 'success': bool(sol.success),
+            'message': str(sol.message), 'nit': sol.nit, 'nfev': objective.nfev}
+
+
+def Calibrate(t_obs, prevalence, deaths, X0, a, b, T0, epsilon, om, fi,
+              params = ('beta_d', 'beta_i', 'p2', 'd2', 'a', 'b'), periodic = False,
+              transient = 20, dispersion = None, sampling = 1.0, reporting = 1.0,
+              bounds = None, n_starts = 1, spread = 0.5, seed = 0, processes = 1,
+              dt = 1.0, max_iter = 200, first_step = 0.1, rtol = 1e-8, atol = 1e-8, **kwargs):
+    '''
+    This function fits parameters of Avian() to HPAI surveillance counts by
+    maximum likelihood. The gradient of the Poisson or negative binomial
+    log-likelihood comes from the exact trajectory sensitivities of
+    SensitivitySolver(), so every objective evaluation is a single stiff solve
+    (no finite differences) and L-BFGS-B needs few of them. The parameters are
+    fitted on a log scale.
+    With periodic = True the data are assumed to come from the seasonal cycle:
+    the initial state is the periodic orbit at t_obs[0], found by
+    PeriodicOrbit() starting from the cycle of the nearest parameters already
+    evaluated, which converges in one or two Newton steps instead of a burn-in
+    from a cold start. Several starts can run in parallel processes.
+    Parameters
+    ----------
+    t_obs : array
+        Observation times in days, e.g. weekly.
+    prevalence : array or None
+        Number of HPAI-infected birds (I2 + I12) observed at each time in t_obs,
+        or None to fit deaths only.
+    deaths : array or None
+        Number of HPAI deaths d2*(I2 + I12 + R1) between consecutive times in
+        t_obs (length len(t_obs) - 1), or None to fit prevalence only.
+    X0 : array
+        Initial state at t_obs[0], or with periodic = True an initial guess for
+        the seasonal cycle.
+    a, b, T0, epsilon, om, fi : scalar
+        Same as in DynamicsSolver(); a and b are starting values if fitted.
+    params : list of str
+        Parameters to fit, any of those of AvianParamJacobian().
+        The default is beta_d, beta_i, p2, d2, a, b.
+    periodic : bool
+        Start every solve on the seasonal cycle, see above. The default is False.
+    transient : int
+        Periods integrated before the first search for the cycle. The default is 20.
+    dispersion : scalar, optional
+        Negative binomial size k; None uses a Poisson likelihood. The default is None.
+    sampling, reporting : scalar
+        Fractions of infected birds and of deaths that are observed.
+        The defaults are 1.
+    bounds : dict, optional
+        Bounds (low, high) by parameter. Unbounded parameters may vary by a
+        factor of 100 from their starting value.
+    n_starts : int
+        Number of starts; the first is the given values, the others are drawn
+        log-normally around them with standard deviation spread. The default is 1.
+    spread : scalar
+        Spread of the random starts on the log scale. The default is 0.5.
+    seed : int
+        Seed of the random starts. The default is 0.
+    processes : int
+        Number of worker processes for the starts; None uses all cores.
+        The default is 1.
+    dt : scalar
+        Largest spacing of the solution grid used to integrate the deaths.
+        The default is 1 day.
+    max_iter : int
+        Maximum number of L-BFGS-B iterations per start. The default is 200.
+    first_step : scalar
+        Length of the first optimizer step on the log scale, small enough for
+        the solves to stay close to the starting values. The default is 0.1.
+    rtol, atol : scalar
+        Tolerances of SensitivitySolver(). The defaults are 1e-8.
+    **kwargs : optional
+        Additional parameters to pass to Avian(); fitted ones are starting values.
+
+    Returns
+    -------
+    estimate : dict
+        Fitted value of every parameter in params, from the best start.
+    info : dict
+        'loglik' of the best start, its 'success' and 'message', the total
+        number of objective evaluations 'nfev', and 'starts', a list with the
+        estimate, log-likelihood and success of every start.
+    '''
+    if prevalence is None and deaths is None:
+        raise ValueError("Nothing to fit, give prevalence and/or deaths.")
+    t_obs = np.asarray(t_obs, dtype = float)
+    if deaths is not None and len(deaths) != len(t_obs) - 1:
+        raise ValueError("deaths must have one count per interval between observation times.")
+    names = list(params)
+    fixed = dict(zip(ARGS, (a, b, T0, epsilon, om, fi)), **kwargs)
+    theta0 = np.array([fixed[k] if k in fixed else _default(k) for k in names], dtype = float)
+
+    z0 = np.log(theta0)
+    bounds = bounds or {}
+    box = [tuple(np.log(bounds[k])) if k in bounds else (z - np.log(100), z + np.log(100))
+           for k, z in zip(names, z0)]
+    rng = np.random.default_rng(seed)
+    starts = [z0] + [np.clip(z0 + spread*rng.standard_normal(len(z0)), *np.transpose(box))
+                     for _ in range(n_starts - 1)]
+
+    setup = (t_obs, prevalence, deaths, X0, fixed, names, periodic, transient, dispersion,
+             sampling, reporting, dt, rtol, atol)
+    jobs = [(z, box, setup, max_iter, first_step) for z in starts]
+
+    if processes == 1 or n_starts == 1:
+        fits = [_fit(*job) for job in jobs]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers = processes) as pool:
+            fits = list(pool.map(_fit, *zip(*jobs)))
+
+    best = max(fits, key = lambda fit: fit['loglik'])
+    if not np.isfinite(best['loglik']):
+        raise RuntimeError(best['message'])
+    runs = [{'estimate': dict(zip(names, np.exp(fit['z']))), 'loglik': fit['loglik'],
+             'success': fit['success']} for fit in fits]
+    return dict(zip(names, np.exp(best['z']))), {'loglik': best['loglik'], 'success': best['success'],
+                                                'message': best['message'],
+                                                'nfev': sum(fit['nfev'] for fit in fits),
+                                                'starts': runs}
@@ -0,0 +1,149 @@
+import json
+import os
+
+import numpy as np
+
+from AIVDynamics import DynamicsSolver
+
+
+def _boundaries(t, every):
+    '''
+    Indices of t at which checkpoints are taken: the first time point at or
+    after t[0] + k*every for every k with t[0] + k*every <= t[-1]. They only
+    depend on the part of t up to each boundary, so a run extended with more
+    time points keeps the same checkpoints.
+    '''
+    thresholds = t[0] + every*np.arange(int((t[-1] - t[0]) // every) + 1)
+    return np.unique(np.searchsorted(t, thresholds, side = 'left'))
+
+
+def _save_checkpoint(run_dir, **data):
+    # write then rename, so a crash never leaves a half-written checkpoint
+    tmp = os.path.join(run_dir, 'checkpoint.tmp.npz')
+    np.savez(tmp, **data)
+    os.replace(tmp, os.path.join(run_dir, 'checkpoint.npz'))
+
+
+def CheckpointSolver(run_dir, X0, t, a, b, T0, epsilon, om, fi, every = 365, method = 'odeint',
+                     **kwargs):
+    '''
+    This function solves the ODE system like DynamicsSolver() while writing
+    checkpoints to run_dir, so a long run can be resumed or extended.
+    The horizon is integrated in segments of `every` days. Each segment starts
+    a fresh integration from the state saved at its first time point, and the
+    state, time index and parameters are saved after it. A resumed run
+    therefore repeats exactly the computations an uninterrupted run makes and
+    gives the same trajectory. The solution is written to run_dir/solution.npy;
+    the checkpoint also records its last written row, so a finished run is
+    returned from disk without integrating again.
+    Parameters
+    ----------
+    run_dir : str
+        Directory of the run, created if needed. If it already holds a
+        checkpoint of the same parameters, the run continues from it; if t is
+        longer than the saved time points, the finished run is extended.
+    X0, t, a, b, T0, epsilon, om, fi :
+        Same as in DynamicsSolver().
+    every : scalar
+        Length of a segment between checkpoints in days. The default is 365.
+    method : str
+        Integration backend of DynamicsSolver(). The default is 'odeint'.
+    **kwargs : optional
+        Additional parameters to pass to Avian() (scalars).
+
+    Returns
+    -------
+    Solution: array
+        Read-only memory map of the solution (shape len(t) x 10).
+    '''
+    os.makedirs(run_dir, exist_ok = True)
+    t = np.asarray(t, dtype = float)
+    X0 = np.asarray(X0, dtype = float)
+    params = json.dumps({'a': a, 'b': b, 'T0': T0, 'epsilon': epsilon, 'om': om, 'fi': fi,
+                         'every': every, 'method': method, **kwargs}, sort_keys = True)
+
+    sol_path = os.path.join(run_dir, 'solution.npy')
+    ckpt_path = os.path.join(run_dir, 'checkpoint.npz')
+
+    if os.path.exists(ckpt_path):
+        ckpt = np.load(ckpt_path)
+        t_saved = ckpt['t']
+        if len(t) < len(t_saved):
+            raise ValueError(f"{run_dir} holds a run of {len(t_saved)} time points; t has "
+                             f"only {len(t)}. Pass the saved time points or a longer t.")
+        n = len(t_saved)
+        if str(ckpt['params']) != params or not np.array_equal(ckpt['X0'], X0) \
+                or not np.array_equal(t_saved[:n], t[:n]):
+            raise ValueError(f"{run_dir} holds a run with different parameters or time points.")
+        start, X = int(ckpt['index']), ckpt['X']
+        written = int(ckpt['written']) if 'written' in ckpt.files else start
+        if len(t) == len(t_saved) and written == len(t) - 1:
+            # a finished run
+            return np.load(sol_path, mmap_mode = 'r')
+
+        if len(t) != len(t_saved):
+            # copy the finished rows into a solution file of the new length
+            old = np.load(sol_path, mmap_mode = 'r')
+            new = np.lib.format.open_memmap(sol_path + '.tmp', mode = 'w+', dtype = float,
+                                            shape = (len(t), 10))
+            new[:start + 1] = old[:start + 1]
+            new.flush()
+            del old, new
+            os.replace(sol_path + '.tmp', sol_path)
+        sol = np.load(sol_path, mmap_mode = 'r+')
+    else:
+        start, X = 0, X0
+        sol = np.lib.format.open_memmap(sol_path, mode = 'w+', dtype = float, shape = (len(t), 10))
+        sol[0] = X0
+        sol.flush()
+        _save_checkpoint(run_dir, X = X0, index = 0, written = 0, t = t, X0 = X0,
+                         params = params)
+
+    bounds = _boundaries(t, every)
+    stops = list(bounds[bounds > start])
+    if (not stops or stops[-1] != len(t) - 1) and start < len(t) - 1:
+        stops.append(len(t) - 1)
+
+    restart = (start, X)
+    for stop in stops:
+        res = DynamicsSolver(X, t[start:stop + 1], a, b, T0, epsilon, om, fi,
+                             method = method, plot = False, **kwargs)
+        sol[start:stop + 1] = res
+        sol.flush()
+        start, X = stop, res[-1]
+
+        # the tail after the last full segment is not a checkpoint, so an
+        # extended run restarts from the same point as an uninterrupted one;
+        # only the last written row is recorded for it
+        if stop in bounds:
+            restart = (stop, X)
+        _save_checkpoint(run_dir, X = restart[1], index = restart[0], written = stop, t = t,
+                         X0 = X0, params = params)
+    del sol
+
+    return np.load(sol_path, mmap_mode = 'r')
+
+
+def ResumeSolver(run_dir, t = None):
+    '''
+    This function continues the run saved in run_dir from its latest
+    checkpoint with the parameters stored there.
+    Parameters
+    ----------
+    run_dir : str
+        Directory of a run started with CheckpointSolver().
+    t : array, optional
+        Time points of the run. The default (None) finishes the saved run; a
+        longer array that starts with the saved time points extends it.
+
+    Returns
+    -------
+    Solution: array
+        Read-only memory map of the solution (shape len(t) x 10).
+    '''
+    ckpt = np.load(os.path.join(run_dir, 'checkpoint.npz'))
+    params = json.loads(str(ckpt['params']))
+    if t is None:
+        t = ckpt['t']
+
+    return CheckpointSolver(run_dir, ckpt['X0'], t, **params)
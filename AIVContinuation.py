@@ -0,0 +1,229 @@
+import numpy as np
+
+from AIVDynamics import Avian, AvianJacobian, _solve, _monodromy
+
+ARGS = ('a', 'b', 'T0', 'epsilon', 'om', 'fi')
+
+
+def _params(params, name, value):
+    '''
+    Positional arguments and keyword parameters of Avian() with the
+    continuation parameter `name` set to value.
+    '''
+    params = dict(params, **{name: value})
+    return tuple(params.pop(k) for k in ARGS), params
+
+
+def Continuation(X0, a, b, T0, epsilon, om, fi, param = 'T0', kind = 'periodic',
+                 p_range = (-np.inf, np.inf), direction = 1, ds = 0.1, ds_min = 1e-4,
+                 ds_max = 1.0, n_steps = 200, tol = 1e-8, max_iter = 8, t0 = 0, **kwargs):
+    '''
+    This function traces a branch of equilibria or seasonal periodic orbits of
+    Avian() in one parameter by pseudo-arclength continuation. Each step
+    predicts the next point along the tangent of the branch and corrects it
+    with Newton's method on the defining equations plus the arclength
+    condition, so folds are passed without trouble. The step length adapts to
+    the number of Newton iterations.
+    Equilibria solve Avian(X) = 0 with the exact Jacobian; periodic orbits
+    solve P(X) - X = 0 on the Poincare map at t0 with the monodromy matrix.
+    Along the branch, folds are detected from a sign change of the parameter
+    component of the tangent, period-doubling points from a real Floquet
+    multiplier crossing -1 (a sign change of det(M + I)), and any other change
+    in the number of unstable eigenvalues or multipliers is reported as a
+    'stability' point (e.g. Hopf, torus or transcritical bifurcations).
+    Parameters
+    ----------
+    X0 : array
+        A point on the branch (initial state of the periodic orbit at t0), or a
+        guess close to it.
+    a, b, T0, epsilon, om, fi : scalar
+        Same as in DynamicsSolver(), at the start of the branch.
+    param : str
+        Name of the continuation parameter: one of a, b, T0, epsilon, om, fi or
+        any parameter of Avian(). The default is 'T0'.
+    kind : str
+        'equilibrium' (requires epsilon = 0) or 'periodic'. The default is 'periodic'.
+    p_range : tuple
+        The continuation stops when the parameter leaves this interval.
+    direction : int
+        +1 to start towards larger parameter values, -1 towards smaller ones.
+    ds, ds_min, ds_max : scalar
+        Initial, minimal and maximal step length. The arclength is measured with
+        each state component scaled by |X0| + 1 and the parameter by its
+        starting value, so ds is roughly the relative change in the parameter.
+        The defaults are 0.1, 1e-4 and 1.
+    n_steps : int
+        Maximum number of continuation steps. The default is 200.
+    tol : scalar
+        Convergence tolerance on the residual relative to |X| + 1. The default is 1e-8.
+    max_iter : int
+        Maximum number of Newton iterations per step. The default is 8.
+    t0 : scalar
+        Time of the Poincare section of periodic orbits. The default is 0.
+    **kwargs : optional
+        Additional parameters to pass to Avian().
+
+    Returns
+    -------
+    p : array
+        Parameter values along the branch.
+    X : array
+        States along the branch, shape (len(p), 10).
+    spectrum : array
+        Eigenvalues of the Jacobian (equilibria) or Floquet multipliers
+        (periodic orbits) at every point, shape (len(p), 10).
+    info : dict
+        'bifurcations': list of dicts with the 'type' ('fold', 'period-doubling'
+        or 'stability'), the interpolated parameter 'p' and state 'X' and the
+        'index' of the first point after it; 'reason' why the continuation
+        stopped ('steps', 'range', 'positivity' or 'step size'); 'nfev'.
+    '''
+    if kind not in ('equilibrium', 'periodic'):
+        raise ValueError(f"Unknown kind {kind!r}, expected 'equilibrium' or 'periodic'.")
+    if kind == 'equilibrium' and (epsilon != 0 or param == 'epsilon'):
+        raise ValueError("Equilibria only exist without seasonality (epsilon = 0).")
+
+    params = {'a': a, 'b': b, 'T0': T0, 'epsilon': epsilon, 'om': om, 'fi': fi, **kwargs}
+    if param not in params:
+        # a parameter of Avian() left at its default
+        import inspect
+        params[param] = inspect.signature(Avian).parameters[param].default
+    nfev = 0
+
+    def residual(y):
+        '''Defining equations G, their derivative [G_X, G_p] and the spectrum at y = (X, p).'''
+        nonlocal nfev
+        X, p = y[:10], y[10]
+        args, kw = _params(params, param, p)
+        h = 1e-6*(abs(p) + 1)
+        args_h, kw_h = _params(params, param, p + h)
+
+        if kind == 'equilibrium':
+            G = Avian(X, 0, *args, **kw)
+            G_X = AvianJacobian(X, 0, *args, **kw)
+            G_p = (Avian(X, 0, *args_h, **kw_h) - G)/h
+            spectrum = np.linalg.eigvals(G_X)
+        else:
+            period = 2*np.pi/args[4]
+            with np.errstate(over = 'ignore', invalid = 'ignore'):
+                PX, M, n = _monodromy(X, t0, period, args, kw)
+                PX_h, out = _solve(X, [t0, t0 + 2*np.pi/args_h[4]], args_h, kw_h,
+                                   rtol = 1e-10, atol = 1e-8)
+            nfev += n + out['nfev']
+            G = PX - X
+            G_X = M - np.eye(10)
+            G_p = (PX_h[-1] - PX)/h
+            spectrum = np.linalg.eigvals(M)
+        return G, np.column_stack([G_X, G_p]), spectrum
+
+    def unstable(spectrum):
+        if kind == 'equilibrium':
+            return int(np.sum(spectrum.real > 0))
+        return int(np.sum(np.abs(spectrum) > 1))
+
+    def tests(tangent, spectrum):
+        # fold: parameter component of the tangent; period doubling: det(M + I)
+        pd = np.prod(spectrum + 1).real if kind == 'periodic' else 1.0
+        return tangent[10], pd, unstable(spectrum)
+
+    p0 = params[param]
+    scale = np.append(np.abs(np.asarray(X0, dtype = float)) + 1, abs(p0) if p0 != 0 else 1.0)
+
+    def converged(y, G):
+        return np.max(np.abs(G)/(np.abs(y[:10]) + 1)) < tol
+
+    def correct(y, v, y_pred):
+        '''Newton's method on G(y) = 0 and v.(z - z_pred) = 0 in scaled coordinates z = y/scale.'''
+        y = y_pred.copy()
+        for k in range(max_iter + 1):
+            try:
+                G, DG, spectrum = residual(y)
+            except RuntimeError:
+                return None
+            if not np.all(np.isfinite(G)):
+                return None
+            if converged(y, G) and (v is None or abs(v @ ((y - y_pred)/scale)) < tol):
+                return y, DG, spectrum, k
+            if k == max_iter:
+                return None
+            if v is None:
+                # parameter fixed: plain Newton on the state
+                y[:10] -= np.linalg.solve(DG[:, :10], G)
+            else:
+                A = np.vstack([DG*scale, v])
+                rhs = np.append(-G, -(v @ ((y - y_pred)/scale)))
+                try:
+                    y += scale*np.linalg.solve(A, rhs)
+                except np.linalg.LinAlgError:
+                    return None
+
+    def tangent(DG, v):
+        A = np.vstack([DG*scale, v])
+        t = np.linalg.solve(A, np.append(np.zeros(10), 1.0))
+        t /= np.linalg.norm(t)
+        return t if t @ v > 0 else -t
+
+    # first point: correct the state at fixed parameter
+    y = np.append(np.asarray(X0, dtype = float), p0)
+    first = correct(y, None, y)
+    if first is None:
+        raise RuntimeError("Newton's method did not converge at the starting point.")
+    y, DG, spectrum, _ = first
+    v = tangent(DG, np.eye(11)[10]*direction)
+
+    ys, spectra = [y], [spectrum]
+    previous = tests(v, spectrum)
+    bifurcations = []
+
+    for _ in range(n_steps):
+        # shorten the step until the corrector converges inside the admissible
+        # region, so the branch is followed up to the edge of the range or the
+        # point where a compartment turns negative
+        reason = 'step size'
+        while ds >= ds_min:
+            new = correct(y, v, y + ds*scale*v)
+            if new is None:
+                reason = 'step size'
+            elif not p_range[0] <= new[0][10] <= p_range[1]:
+                reason = 'range'
+            elif np.any(new[0][:10] < -tol*scale[:10]):
+                reason = 'positivity'
+            else:
+                reason = None
+                break
+            ds /= 2
+        if reason is not None:
+            break
+        y_new, DG, spectrum, iters = new
+
+        v = tangent(DG, v)
+        current = tests(v, spectrum)
+        fold, pd, n_unstable = current
+
+        found = []
+        if np.sign(fold) != np.sign(previous[0]):
+            found.append(('fold', previous[0], fold))
+        if np.sign(pd) != np.sign(previous[1]):
+            found.append(('period-doubling', previous[1], pd))
+        if n_unstable != previous[2] and not found:
+            found.append(('stability', 1.0, -1.0))
+        for name, f0, f1 in found:
+            s = f0/(f0 - f1) if f0 != f1 else 0.5
+            y_b = y + s*(y_new - y)
+            bifurcations.append({'type': name, 'p': y_b[10], 'X': y_b[:10], 'index': len(ys)})
+
+        ys.append(y_new)
+        spectra.append(spectrum)
+        previous = current
+        y = y_new
+
+        if iters <= 2:
+            ds = min(1.5*ds, ds_max)
+        elif iters > 4:
+            ds = max(ds/2, ds_min)
+    else:
+        reason = 'steps'
+
+    ys = np.array(ys)
+    return ys[:, 10], ys[:, :10], np.array(spectra), \
+        {'bifurcations': bifurcations, 'reason': reason, 'nfev': nfev}
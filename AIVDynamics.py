@@ -50,12 +50,37 @@ def Viral(a, b, Temp):
     return Viral
 
 
+def DecayRates(t, a, b, T0, epsilon, om, fi, temp = None):
+    '''
+    LPAI and HPAI viral decay rates at time t.
+    Parameters
+    ----------
+    t, a, b, T0, epsilon, om, fi :
+        Same as in Avian().
+    temp : callable, optional
+        Temperature source temp(t) replacing Temp(), e.g. an
+        AIVTemperature.TemperatureSeries. If it has a decay(a, b, t) method,
+        its precomputed rates are used. The default (None) uses Temp().
+
+    Returns
+    -------
+    Decay rates of LPAI and HPAI
+    '''
+    if temp is None:
+        current_temp = Temp(t, T0, epsilon, om, fi)
+    elif hasattr(temp, 'decay'):
+        return temp.decay(0.114, 3.7594, t), temp.decay(a, b, t)
+    else:
+        current_temp = temp(t)
+    return Viral(0.114, 3.7594, current_temp), Viral(a, b, current_temp)
+
+
 
 
 
 def Avian(X, t, a, b, T0, epsilon, om, fi, beta_d = 2.13e-9, beta_i = 3.55e-9,
           d = 0.1/365, d2 = 0.88, p1 = 1e3, p2 = 1e4,
-          gamma = 0.14, lambd = 2, eta = 0.038, alpha1 = 0.065, alpha2 = 0.065):
+          gamma = 0.14, lambd = 2, eta = 0.038, alpha1 = 0.065, alpha2 = 0.065, temp = None):
     '''
     Parameters
     ----------
@@ -85,12 +110,15 @@ def Avian(X, t, a, b, T0, epsilon, om, fi, beta_d = 2.13e-9, beta_i = 3.55e-9,
         Mutation rate for LPAI. The default is 0.065.
     alpha2 : scalar
         Mutation rate for HPAI. The default is 0.065.
+    temp : callable, optional
+        Measured temperature source replacing Temp(), see DecayRates().
+        The default is None.
 
     Returns
     -------
     Array dynamics
     '''
-    current_temp = Temp(t, T0, epsilon, om, fi)
+    w1, w2 = DecayRates(t, a, b, T0, epsilon, om, fi, temp)
     S, I1, I2, R1, R2, I12, I21, R12, V1, V2 = X
     
 
@@ -127,13 +155,377 @@ def Avian(X, t, a, b, T0, epsilon, om, fi, beta_d = 2.13e-9, beta_i = 3.55e-9,
     
     dotR12 =  gamma*I12 + gamma*I21 - eta*R12 - d*R12
     
-    dotV1 = p1*I1 + p1*I21 - Viral(0.114, 3.7594, current_temp) *V1  # regular LPAI
-    dotV2 = p2*I2 + p2*I12 - Viral(a, b, current_temp)*V2  # HPAI
+    dotV1 = p1*I1 + p1*I21 - w1*V1  # regular LPAI
+    dotV2 = p2*I2 + p2*I12 - w2*V2  # HPAI
     
     return np.array([dotS, dotI1, dotI2, dotR1, dotR2, dotI12, dotI21, dotR12, dotV1, dotV2])
 
 
-def DynamicsSolver(X0, t, a, b, T0, epsilon, om, fi, **kwargs):
+def AvianJacobian(X, t, a, b, T0, epsilon, om, fi, beta_d = 2.13e-9, beta_i = 3.55e-9,
+                  d = 0.1/365, d2 = 0.88, p1 = 1e3, p2 = 1e4,
+                  gamma = 0.14, lambd = 2, eta = 0.038, alpha1 = 0.065, alpha2 = 0.065,
+                  temp = None):
+    '''
+    Exact Jacobian of Avian() with respect to the state X.
+    Parameters
+    ----------
+    X : array
+        State of shape (10,), or (10, N) for N states evaluated at once.
+    t : scalar
+        Current time.
+    a, b, T0, epsilon, om, fi, **kwargs :
+        Same as in Avian(). Parameters can be arrays broadcasting against X[0].
+
+    Returns
+    -------
+    J : array
+        Jacobian of shape (10, 10) (or (10, 10, N)) with J[i, j] = d(dotX_i)/dX_j
+    '''
+    S, I1, I2, R1, R2, I12, I21, R12, V1, V2 = X
+
+    w1, w2 = DecayRates(t, a, b, T0, epsilon, om, fi, temp)
+
+    # forces of infection of LPAI and HPAI, and the mutation terms as written in Avian()
+    L1 = beta_i*V1 + beta_d*I1 + beta_d*I21
+    L2 = beta_i*V2 + beta_d*I2 + beta_d*I12
+    H1 = beta_d*(I1 + V1 + I21)
+    H2 = beta_d*(I2 + V2 + I12)
+
+    shape = np.broadcast(S, w1, w2, L1, L2, d, d2, gamma, eta, alpha1, alpha2).shape
+    J = np.zeros((10, 10) + shape)
+
+    # coefficients of L1, L2, H1 and H2 in the rows of S, I1, I2, R1, R2, I12 and I21
+    C = np.zeros((4, 7) + shape)
+    C[0, 0] = C[1, 0] = -S
+    C[0, 1], C[3, 1] = (1 - alpha1)*S, alpha2*S
+    C[1, 2], C[2, 2] = (1 - alpha2)*S, alpha1*S
+    C[0, 3], C[1, 3] = -alpha1*R1, -(1 - alpha2)*R1
+    C[0, 4], C[1, 4] = -(1 - alpha1)*R2, -alpha2*R2
+    C[0, 5], C[1, 5] = alpha1*R1, (1 - alpha2)*R1
+    C[0, 6], C[1, 6] = (1 - alpha1)*R2, alpha2*R2
+
+    # terms through the forces, all rows at once: L1 and H1 depend on I1, I21
+    # and V1, L2 and H2 on I2, I12 and V2
+    J[:7, 1] = J[:7, 6] = beta_d*(C[0] + C[2])
+    J[:7, 2] = J[:7, 5] = beta_d*(C[1] + C[3])
+    J[:7, 8] = beta_i*C[0] + beta_d*C[2]
+    J[:7, 9] = beta_i*C[1] + beta_d*C[3]
+
+    # S
+    J[0, 0] = -(L1 + L2) - d
+    J[0, 3] = J[0, 4] = J[0, 7] = eta
+
+    # I1
+    J[1, 0] = (1 - alpha1)*L1 + alpha2*H2
+    J[1, 1] += -(gamma + d)
+
+    # I2
+    J[2, 0] = (1 - alpha2)*L2 + alpha1*H1
+    J[2, 2] += -(gamma + d + d2)
+
+    # R1
+    J[3, 1] += gamma
+    J[3, 3] = -eta - (1 - alpha2)*L2 - alpha1*L1 - (d + d2)
+
+    # R2
+    J[4, 2] += gamma
+    J[4, 4] = -eta - (1 - alpha1)*L1 - alpha2*L2 - d
+
+    # I12
+    J[5, 3] = (1 - alpha2)*L2 + alpha1*L1
+    J[5, 5] += -(d + d2 + gamma)
+
+    # I21
+    J[6, 4] = (1 - alpha1)*L1 + alpha2*L2
+    J[6, 6] += -(d + gamma)
+
+    # R12
+    J[7, 5] = J[7, 6] = gamma
+    J[7, 7] = -(eta + d)
+
+    # V1, V2
+    J[8, 1] = J[8, 6] = p1
+    J[8, 8] = -w1
+    J[9, 2] = J[9, 5] = p2
+    J[9, 9] = -w2
+
+    return J
+
+
+def AvianSparsity():
+    '''
+    Sparsity pattern of AvianJacobian().
+
+    Returns
+    -------
+    Boolean array of shape (10, 10), True where d(dotX_i)/dX_j can be non-zero
+    '''
+    return AvianJacobian(np.ones(10), 0, 1, 1, 1, 1, 1, 0) != 0
+
+
+def AvianParamJacobian(X, t, a, b, T0, epsilon, om, fi, params, beta_d = 2.13e-9, beta_i = 3.55e-9,
+                       d = 0.1/365, d2 = 0.88, p1 = 1e3, p2 = 1e4,
+                       gamma = 0.14, lambd = 2, eta = 0.038, alpha1 = 0.065, alpha2 = 0.065,
+                       temp = None):
+    '''
+    Exact derivatives of Avian() with respect to its parameters.
+    Parameters
+    ----------
+    X : array
+        State of shape (10,), or (10, N) for N states evaluated at once.
+    t : scalar
+        Current time.
+    a, b, T0, epsilon, om, fi, **kwargs :
+        Same as in Avian().
+    params : list of str
+        Names of the parameters: any of a, b, T0, epsilon, beta_d, beta_i, d,
+        d2, p1, p2, gamma, lambd, eta, alpha1, alpha2. With a measured
+        temperature source temp, T0 and epsilon have no effect.
+
+    Returns
+    -------
+    Fp : array
+        Array of shape (10, len(params)) (or (10, len(params), N)) with
+        Fp[i, k] = d(dotX_i)/d(params[k])
+    '''
+    current_temp = Temp(t, T0, epsilon, om, fi) if temp is None else temp(t)
+    S, I1, I2, R1, R2, I12, I21, R12, V1, V2 = X
+
+    w1, w2 = DecayRates(t, a, b, T0, epsilon, om, fi, temp)
+
+    L1 = beta_i*V1 + beta_d*I1 + beta_d*I21
+    L2 = beta_i*V2 + beta_d*I2 + beta_d*I12
+    H1 = beta_d*(I1 + V1 + I21)
+    H2 = beta_d*(I2 + V2 + I12)
+
+    def infection(l1, l2, h1, h2):
+        # rows of a transmission rate, given the derivatives of L1, L2, H1, H2
+        return {0: -S*(l1 + l2),
+                1: (1 - alpha1)*S*l1 + alpha2*S*h2,
+                2: (1 - alpha2)*S*l2 + alpha1*S*h1,
+                3: -(1 - alpha2)*R1*l2 - alpha1*R1*l1,
+                4: -(1 - alpha1)*R2*l1 - alpha2*R2*l2,
+                5: (1 - alpha2)*R1*l2 + alpha1*R1*l1,
+                6: (1 - alpha1)*R2*l1 + alpha2*R2*l2}
+
+    def temperature(dT):
+        # rows of a parameter of Temp(), given dT/dparameter
+        if temp is not None:
+            return {}
+        return {8: -0.114*w1*V1*dT, 9: -a*w2*V2*dT}
+
+    rows = {
+        'a': lambda: {9: -w2*current_temp*V2},
+        'b': lambda: {9: w2*V2},
+        'T0': lambda: temperature(1),
+        'epsilon': lambda: temperature(np.sin(om*t + fi)),
+        'beta_d': lambda: infection(I1 + I21, I2 + I12, I1 + V1 + I21, I2 + V2 + I12),
+        'beta_i': lambda: infection(V1, V2, 0, 0),
+        'd': lambda: {0: -S, 1: -I1, 2: -I2, 3: -R1, 4: -R2, 5: -I12, 6: -I21, 7: -R12},
+        'd2': lambda: {2: -I2, 3: -R1, 5: -I12},
+        'p1': lambda: {8: I1 + I21},
+        'p2': lambda: {9: I2 + I12},
+        'gamma': lambda: {1: -I1, 2: -I2, 3: I1, 4: I2, 5: -I12, 6: -I21, 7: I12 + I21},
+        'lambd': lambda: {0: 1},
+        'eta': lambda: {0: R1 + R2 + R12, 3: -R1, 4: -R2, 7: -R12},
+        'alpha1': lambda: {1: -S*L1, 2: S*H1, 3: -R1*L1, 4: R2*L1, 5: R1*L1, 6: -R2*L1},
+        'alpha2': lambda: {1: S*H2, 2: -S*L2, 3: R1*L2, 4: -R2*L2, 5: -R1*L2, 6: R2*L2},
+    }
+    for name in params:
+        if name not in rows:
+            raise ValueError(f"No derivative with respect to {name!r}, expected one of {list(rows)}.")
+
+    Fp = np.zeros((10, len(params)) + np.shape(S))
+    for k, name in enumerate(params):
+        for row, value in rows[name]().items():
+            Fp[row, k] = value
+
+    return Fp
+
+
+def _solve(X0, t, args, kwargs, method = 'odeint', jac = True,
+           rtol = 1.49012e-8, atol = 1.49012e-8):
+    '''
+    Integrate Avian() over t with the requested backend.
+    Returns the len(t) x 10 solution and a dict with the number of
+    right-hand side ('nfev') and Jacobian ('njev') evaluations.
+    '''
+    rhs = lambda X, tt: Avian(X, tt, *args, **kwargs)
+    Dfun = (lambda X, tt: AvianJacobian(X, tt, *args, **kwargs)) if jac else None
+
+    if method == 'odeint':
+        from scipy.integrate import odeint
+
+        res, out = odeint(rhs, X0, t, Dfun = Dfun, rtol = rtol, atol = atol,
+                          mxstep = 100000, full_output = True)
+        if out['message'] != 'Integration successful.':
+            raise RuntimeError(out['message'])
+        info = {'method': method, 'nfev': int(out['nfe'][-1]), 'njev': int(out['nje'][-1])}
+
+    elif method in ('LSODA', 'BDF', 'Radau'):
+        from scipy.integrate import solve_ivp
+
+        options = {}
+        if jac:
+            options['jac'] = lambda tt, X: Dfun(X, tt)
+        elif method != 'LSODA':
+            options['jac_sparsity'] = AvianSparsity()
+
+        t = np.asarray(t, dtype = float)
+        sol = solve_ivp(lambda tt, X: rhs(X, tt), (t[0], t[-1]), X0, method = method,
+                        t_eval = t, rtol = rtol, atol = atol, **options)
+        if not sol.success:
+            raise RuntimeError(sol.message)
+        res = sol.y.T
+        info = {'method': method, 'nfev': int(sol.nfev), 'njev': int(sol.njev)}
+
+    else:
+        raise ValueError(f"Unknown method {method!r}, expected 'odeint', 'LSODA', 'BDF' or 'Radau'.")
+
+    return res, info
+
+
+def Decimate(x, y, n_out):
+    '''
+    Downsample the curve (x, y) to n_out points with the Largest-Triangle-
+    Three-Buckets algorithm, which keeps the visual shape (peaks and troughs)
+    of the curve at screen resolution.
+    Parameters
+    ----------
+    x, y : array
+        Curve to downsample.
+    n_out : int
+        Number of points to keep (at least 3).
+
+    Returns
+    -------
+    x, y : arrays of length n_out (or the input if it is already shorter)
+    '''
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return x, y
+
+    # first and last points are kept, the rest is split into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    keep = np.empty(n_out, dtype = int)
+    keep[0], keep[-1] = 0, n - 1
+
+    for k in range(n_out - 2):
+        lo, hi = edges[k], edges[k + 1]
+        # average of the next bucket (or the last point)
+        nxt = slice(edges[k + 1], edges[k + 2]) if k < n_out - 3 else slice(n - 1, n)
+        cx, cy = x[nxt].mean(), y[nxt].mean()
+        ax, ay = x[keep[k]], y[keep[k]]
+        area = np.abs((ax - cx)*(y[lo:hi] - ay) - (ax - x[lo:hi])*(cy - ay))
+        keep[k + 1] = lo + np.argmax(area)
+
+    return x[keep], y[keep]
+
+
+def PlotDynamics(t, res, max_points = None, show = True, pyplot = True):
+    '''
+    This function plots the dynamics computed by DynamicsSolver()
+    Parameters
+    ----------
+    t : array
+        Time period of the dynamics.
+    res : array
+        Solution array (shape len(t) x 10).
+    max_points : int, optional
+        Downsample every curve to this many points with Decimate() before
+        plotting, e.g. the width of the figure in pixels. The default is None
+        (plot every point).
+    show : bool
+        Call plt.show() after each figure. The default is True.
+    pyplot : bool
+        Create the figures through pyplot. With False they are plain
+        matplotlib Figures that the caller's backend never sees, e.g. to save
+        them from a script; show is then ignored. The default is True.
+
+    Returns
+    -------
+    figs : list
+        The three matplotlib figures (all birds, infected and recovered birds,
+        virus in water)
+    '''
+    if pyplot:
+        import matplotlib.pyplot as plt
+        subplots = plt.subplots
+    else:
+        from matplotlib.figure import Figure
+        show = False
+
+        def subplots(figsize):
+            fig = Figure(figsize = figsize)
+            return fig, fig.add_subplot()
+
+    t = np.asarray(t)
+    S, I1, I2, R1, R2, I12, I21, R12, V1, V2 = np.asarray(res).T
+
+    def line(y):
+        if max_points is None:
+            return t, y
+        return Decimate(t, y, max_points)
+
+    #convert time into years
+    years = t[-1]/365
+    figs = []
+    
+    fig, ax = subplots(figsize=(10, 8))
+    ax.set_title(f"Limit cycle t = {years:.2f} years", fontsize = 20)
+    ax.plot(*line(S), label='Susceptible', color = 'black', linestyle = '-')
+    ax.plot(*line(I1),  color = 'b', linestyle = '--')
+    ax.plot(*line(I2),  color = 'r', linestyle = '--')
+    ax.plot(*line(I12),  color = 'tomato', linestyle = '-.')
+    ax.plot(*line(I21),  color = 'steelblue', linestyle = '-.')
+    ax.plot(*line(R1),  color = 'greenyellow', linestyle = ':')
+    ax.plot(*line(R2),  color = 'yellowgreen', linestyle = ':')
+    ax.plot(*line(R12), color = 'g', linestyle = ":")
+    ax.set_xlabel('time (days)', fontsize = 20)
+    ax.set_ylabel('Number of birds', fontsize = 20)
+    ax.legend()
+    fig.tight_layout()
+    figs.append(fig)
+    if show:
+        plt.show()
+
+    fig, ax = subplots(figsize=(10, 8))
+
+    ax.set_title("Limit cycle - Infected and Recovered birds", fontsize=20)
+    ax.plot(*line(I1),  label='Infected by average LPAI', color='b',         linestyle='--')
+    ax.plot(*line(I2),  label='Infected by H5N1',         color='r',         linestyle='--')
+    ax.plot(*line(I12), label='Cross Infected by average LPAI', color='tomato',    linestyle='-.')
+    ax.plot(*line(I21), label='Cross Infected by H5N1',        color='steelblue', linestyle='-.')
+    ax.plot(*line(R1),  label='Recovered (LPAI)',              color='greenyellow', linestyle=':')
+    ax.plot(*line(R2),  label='Recovered (HPAI)',              color='yellowgreen', linestyle=':')
+    ax.plot(*line(R12), label='Recovered (cross)',             color='g',           linestyle=':')
+
+    ax.set_xlabel('time (days)', fontsize = 20)
+    ax.set_ylabel('Number of birds', fontsize = 20)
+    ax.legend()
+    fig.tight_layout()
+    figs.append(fig)
+    if show:
+        plt.show()
+
+
+    fig, ax = subplots(figsize=(10, 8))
+    ax.plot(*line(V1), label='LPAI particles in water', color='b')
+    ax.plot(*line(V2), label='H5N1 particles in water', color='r')
+
+    ax.legend()
+    fig.tight_layout()
+    figs.append(fig)
+    if show:
+        plt.show()
+
+    return figs
+
+
+def DynamicsSolver(X0, t, a, b, T0, epsilon, om, fi, method = 'odeint', jac = True,
+                   full_output = False, plot = True, **kwargs):
     '''
     This function solves the ODE system and plots the dynamics
     Parameters
@@ -154,63 +546,519 @@ def DynamicsSolver(X0, t, a, b, T0, epsilon, om, fi, **kwargs):
         Temperature frequency.
     fi : scalar
         Phase shift of temperature.
+    method : str
+        Integration backend. 'odeint' (LSODA through scipy.integrate.odeint, the default),
+        or 'LSODA', 'BDF' and 'Radau' through scipy.integrate.solve_ivp.
+    jac : bool
+        Use the exact Jacobian AvianJacobian() instead of finite differences.
+        The default is True.
+    full_output : bool
+        Also return a dict with the backend name and the number of right-hand side
+        ('nfev') and Jacobian ('njev') evaluations. The default is False.
+    plot : bool
+        Plot the dynamics with PlotDynamics(). Set to False to only solve, e.g. in
+        batch runs; matplotlib is then not imported. The default is True.
     **kwargs : optional
         Additional parameters to pass to avain().
 
     Returns
     -------
     Solution: array
-        Solution array (shape len(t) x 10 ) and the dynamcis plot
+        Solution array (shape len(t) x 10). The figures of PlotDynamics() are
+        shown but not returned.
+    info : dict
+        Only with full_output = True, see above.
+    '''
+    res, info = _solve(X0, t, (a, b, T0, epsilon, om, fi), kwargs, method = method, jac = jac)
+    if plot:
+        PlotDynamics(t, res)
+
+    if full_output:
+        return res, info
+    return res
+
+
+
+def AvianEnsemble(X, t, a, b, T0, epsilon, om, fi, **kwargs):
+    '''
+    Vectorized right-hand side of Avian() for an ensemble of N members.
+    Parameters
+    ----------
+    X : array
+        Ensemble state of shape (N, 10), one row per member in the order
+        [S, I1, I2, R1, R2, I12, I21, R12, V1, V2].
+    t : scalar
+        Current time.
+    a, b, T0, epsilon, om, fi : scalar or array of shape (N,)
+        Same as in Avian(), given either once for all members or per member.
+    **kwargs : optional
+        Additional parameters of Avian(), scalar or array of shape (N,).
+
+    Returns
+    -------
+    Array of shape (N, 10) with the time derivatives of every member
+    '''
+    return Avian(np.asarray(X).T, t, a, b, T0, epsilon, om, fi, **kwargs).T
+
+
+def _banded(J):
+    '''
+    Pack N diagonal blocks J (shape (10, 10, N)) into the banded layout odeint()
+    expects for ml = mu = 9, i.e. band[i - j + 9, j] = d(dotX_i)/dX_j.
+    '''
+    rows, cols = np.nonzero(AvianSparsity())
+    N = J.shape[2]
+    band = np.zeros((19, N, 10))
+    band[rows - cols + 9, :, cols] = J[rows, cols]
+    return band.reshape(19, N*10)
+
+
+def EnsembleSolver(X0, t, a, b, T0, epsilon, om, fi, rtol = 1e-6, atol = 1e-6, **kwargs):
+    '''
+    This function solves the ODE system for N parameter sets at once.
+    All members are stacked into one state vector and advanced together with
+    the vectorized right-hand side AvianEnsemble(). Members do not interact, so
+    the Jacobian is block diagonal; it is passed to odeint() in banded form
+    from AvianJacobian(), which keeps the cost linear in N.
+    Parameters
+    ----------
+    X0 : array
+        Initial conditions of shape (10,) shared by all members or (N, 10).
+    t : array
+        Time period of the dynamics.
+    a, b, T0, epsilon, om, fi : scalar or array of shape (N,)
+        Same as in DynamicsSolver(), given once or per member.
+    rtol, atol : scalar
+        Relative and absolute tolerances of odeint(). The defaults are 1e-6.
+    **kwargs : optional
+        Additional parameters to pass to Avian(), scalar or array of shape (N,).
+        A temperature source temp is shared by all members; with one column
+        per site it gives every member its own site.
+
+    Returns
+    -------
+    Solution: array
+        Solution array of shape (N, len(t), 10)
     '''
     from scipy.integrate import odeint
-    
-    res = odeint(Avian, X0, t, args = (a, b, T0, epsilon, om, fi))
-    S, I1, I2, R1, R2, I12, I21, R12, V1, V2 = res.T
-    
-    import matplotlib.pyplot as plt 
-    
-    #convert time into years
-    years = t[-1]/365
-    
-    fig, ax = plt.subplots(figsize=(10, 8))
-    plt.title(f"Limit cycle t = {years:.2f} years", fontsize = 20)
-    plt.plot(t, S, label='Susceptible', color = 'black', linestyle = '-')
-    plt.plot(t, I1,  color = 'b', linestyle = '--')
-    plt.plot(t, I2,  color = 'r', linestyle = '--')
-    plt.plot(t, I12,  color = 'tomato', linestyle = '-.')
-    plt.plot(t, I21,  color = 'steelblue', linestyle = '-.')
-    plt.plot(t, R1,  color = 'greenyellow', linestyle = ':')
-    plt.plot(t, R2,  color = 'yellowgreen', linestyle = ':')
-    plt.plot(t, R12, color = 'g', linestyle = ":")
-    plt.xlabel('time (days)', fontsize = 20)
-    plt.ylabel('Number of birds', fontsize = 20)
-    plt.legend()
-    plt.tight_layout()
-    plt.show()
-
-    fig, ax = plt.subplots(figsize=(10, 8))
 
-    ax.set_title("Limit cycle - Infected and Recovered birds", fontsize=20)
-    ax.plot(t, I1,  label='Infected by average LPAI', color='b',         linestyle='--')
-    ax.plot(t, I2,  label='Infected by H5N1',         color='r',         linestyle='--')
-    ax.plot(t, I12, label='Cross Infected by average LPAI', color='tomato',    linestyle='-.')
-    ax.plot(t, I21, label='Cross Infected by H5N1',        color='steelblue', linestyle='-.')
-    ax.plot(t, R1,  label='Recovered (LPAI)',              color='greenyellow', linestyle=':')
-    ax.plot(t, R2,  label='Recovered (HPAI)',              color='yellowgreen', linestyle=':')
-    ax.plot(t, R12, label='Recovered (cross)',             color='g',           linestyle=':')
+    X0 = np.asarray(X0, dtype = float)
+    params = [np.asarray(p, dtype = float) for p in (a, b, T0, epsilon, om, fi)]
+    temp = kwargs.pop('temp', None)
+    extra = {k: np.asarray(v, dtype = float) for k, v in kwargs.items()}
+
+    shape = np.broadcast_shapes(X0.shape[:-1], *(p.shape for p in params),
+                                *(v.shape for v in extra.values()),
+                                np.shape(temp(t[0])) if temp is not None else ())
+    if len(shape) > 1:
+        raise ValueError("Ensemble parameters must be scalars or 1-D arrays.")
+    N = shape[0] if shape else 1
+
+    X0 = np.broadcast_to(X0, (N, 10))
+    params = [np.broadcast_to(p, (N,)) for p in params]
+    extra = {k: np.broadcast_to(v, (N,)) for k, v in extra.items()}
+    extra['temp'] = temp
+
+    def rhs(y, tt):
+        return AvianEnsemble(y.reshape(N, 10), tt, *params, **extra).ravel()
+
+    def Dfun(y, tt):
+        return _banded(AvianJacobian(y.reshape(N, 10).T, tt, *params, **extra))
+
+    res = odeint(rhs, X0.ravel(), t, Dfun = Dfun, ml = 9, mu = 9, rtol = rtol, atol = atol)
+
+    return res.reshape(len(t), N, 10).transpose(1, 0, 2)
+
+
+def _monodromy(X0, t0, period, args, kwargs, rtol = 1e-10, atol = 1e-8):
+    '''
+    Integrate Avian() together with its variational equations dPhi/dt = J Phi,
+    Phi(t0) = I, over one period. Returns the end state, the monodromy matrix
+    Phi(t0 + period) and the number of right-hand side evaluations.
+    '''
+    from scipy.integrate import odeint
+
+    def rhs(y, tt):
+        X = y[:10]
+        Phi = y[10:].reshape(10, 10)   # row k holds column k of Phi
+        J = AvianJacobian(X, tt, *args, **kwargs)
+        return np.concatenate([Avian(X, tt, *args, **kwargs), (Phi @ J.T).ravel()])
+
+    def Dfun(y, tt):
+        # the coupling of Phi to X is dropped; odeint only needs an approximate
+        # Jacobian and the remaining 11 diagonal blocks are all J
+        J = AvianJacobian(y[:10], tt, *args, **kwargs)
+        return _banded(np.repeat(J[:, :, None], 11, axis = 2))
+
+    y0 = np.concatenate([X0, np.eye(10).ravel()])
+    res, out = odeint(rhs, y0, [t0, t0 + period], Dfun = Dfun, ml = 9, mu = 9,
+                      rtol = rtol, atol = atol, mxstep = 100000, full_output = True)
+    if out['message'] != 'Integration successful.' or not np.all(np.isfinite(res[-1])):
+        raise RuntimeError(out['message'])
+
+    return res[-1, :10], res[-1, 10:].reshape(10, 10).T, int(out['nfe'][-1])
+
+
+def PeriodicOrbit(X0, a, b, T0, epsilon, om, fi, t0 = 0, tol = 1e-8, max_iter = 50,
+                  n_transient = 10, n_points = 366, full_output = False, **kwargs):
+    '''
+    This function finds the seasonal limit cycle directly by shooting on the
+    Poincare map X(t0) -> X(t0 + 2*pi/om). Newton's method is applied to
+    P(X) - X = 0, with the monodromy matrix of the variational equations as
+    the derivative of P, instead of integrating until transients die out.
+    Parameters
+    ----------
+    X0 : array
+        Initial guess in the order [S, I1, I2, R1, R2, I12, I21, R12, V1, V2].
+    a, b, T0, epsilon, om, fi : scalar
+        Same as in DynamicsSolver().
+    t0 : scalar
+        Time of the Poincare section. The default is 0.
+    tol : scalar
+        Convergence tolerance on max |P(X) - X| / (|X| + 1). The period is
+        integrated with relative tolerance tol/10 and absolute tolerance tol.
+        The default is 1e-8.
+    max_iter : int
+        Maximum number of Newton iterations. The default is 50.
+    n_transient : int
+        Number of periods to integrate from X0 before shooting, to move a poor
+        initial guess closer to the cycle, where Newton's method converges in a
+        few steps. The default is 10.
+    n_points : int
+        Number of points of the returned orbit over one period. The default is 366.
+    full_output : bool
+        Also return a dict with the number of iterations, the final residual,
+        the monodromy matrix and the number of right-hand side evaluations.
+        The default is False.
+    **kwargs : optional
+        Additional parameters to pass to Avian().
+
+    Returns
+    -------
+    orbit : array
+        Periodic solution of shape (n_points x 10) over [t0, t0 + 2*pi/om].
+    multipliers : array
+        Floquet multipliers (eigenvalues of the monodromy matrix). The cycle is
+        stable if all of them lie inside the unit circle.
+    '''
+    args = (a, b, T0, epsilon, om, fi)
+    period = 2*np.pi/om
+    X = np.asarray(X0, dtype = float)
+    tols = dict(rtol = tol/10, atol = tol)
+    nfev = 0
+
+    if n_transient > 0:
+        res, info = _solve(X, t0 + period*np.arange(n_transient + 1), args, kwargs)
+        X = res[-1]
+        nfev += info['nfev']
+
+    def residual(X, PX):
+        return np.max(np.abs(PX - X)/(np.abs(X) + 1))
+
+    PX, M, n = _monodromy(X, t0, period, args, kwargs, **tols)
+    nfev += n
+    r = residual(X, PX)
+
+    for k in range(max_iter):
+        if r < tol:
+            break
+
+        step = np.linalg.solve(M - np.eye(10), X - PX)
+
+        # backtrack until the residual decreases
+        lam = 1.0
+        while True:
+            X_new = X + lam*step
+            try:
+                with np.errstate(over = 'ignore', invalid = 'ignore'):
+                    PX_new, M_new, n = _monodromy(X_new, t0, period, args, kwargs, **tols)
+                nfev += n
+                r_new = residual(X_new, PX_new)
+            except RuntimeError:
+                r_new = np.inf
+            if r_new < r:
+                break
+            lam *= 0.5
+            if lam < 1e-3:
+                # Newton makes no progress here, advance one period along the flow instead
+                X_new = PX
+                PX_new, M_new, n = _monodromy(X_new, t0, period, args, kwargs, **tols)
+                nfev += n
+                r_new = residual(X_new, PX_new)
+                break
+
+        X, PX, M, r = X_new, PX_new, M_new, r_new
+    else:
+        if r >= tol:
+            raise RuntimeError(f"Shooting did not converge in {max_iter} iterations "
+                               f"(residual {r:.3e}).")
+
+    multipliers = np.linalg.eigvals(M)
+
+    t = np.linspace(t0, t0 + period, n_points)
+    orbit, info = _solve(X, t, args, kwargs)
+    nfev += info['nfev']
+
+    if full_output:
+        return orbit, multipliers, {'iterations': k, 'residual': r,
+                                    'monodromy': M, 'nfev': nfev}
+    return orbit, multipliers
+
+
+def StreamSolver(X0, t, a, b, T0, epsilon, om, fi, chunk = 365, method = 'LSODA', jac = True,
+                 rtol = 1.49012e-8, atol = 1.49012e-8, **kwargs):
+    '''
+    This function solves the ODE system like DynamicsSolver() but yields the
+    solution in chunks of `chunk` days instead of returning it at once.
+    A single integrator object is stepped through the whole horizon, so its
+    step size and history carry over from one chunk to the next, and only one
+    chunk of output is held in memory at a time.
+    Parameters
+    ----------
+    X0, t, a, b, T0, epsilon, om, fi :
+        Same as in DynamicsSolver().
+    chunk : scalar
+        Length of a chunk in days. The default is 365.
+    method : str
+        'LSODA' (default), 'BDF' or 'Radau' from scipy.integrate.
+    jac : bool
+        Use the exact Jacobian AvianJacobian(). The default is True.
+    rtol, atol : scalar
+        Relative and absolute tolerances. The defaults are those of odeint().
+    **kwargs : optional
+        Additional parameters to pass to Avian().
+
+    Yields
+    ------
+    t_chunk : array
+        Times of the chunk (a slice of t).
+    res_chunk : array
+        Solution at t_chunk (shape len(t_chunk) x 10).
+    '''
+    from scipy.integrate import LSODA, BDF, Radau
+
+    solvers = {'LSODA': LSODA, 'BDF': BDF, 'Radau': Radau}
+    if method not in solvers:
+        raise ValueError(f"Unknown method {method!r}, expected 'LSODA', 'BDF' or 'Radau'.")
+
+    args = (a, b, T0, epsilon, om, fi)
+    t = np.asarray(t, dtype = float)
+    X0 = np.asarray(X0, dtype = float)
+
+    options = {}
+    if jac:
+        options['jac'] = lambda tt, X: AvianJacobian(X, tt, *args, **kwargs)
+    solver = solvers[method](lambda tt, X: Avian(X, tt, *args, **kwargs), t[0], X0, t[-1],
+                             rtol = rtol, atol = atol, **options)
+
+    n_chunks = int(np.ceil((t[-1] - t[0]) / chunk)) or 1
+    splits = np.searchsorted(t, t[0] + chunk*np.arange(1, n_chunks), side = 'left')
+
+    start, i = 0, 1
+    for stop in list(splits) + [len(t)]:
+        block = np.empty((stop - start, 10))
+        if start == 0:
+            block[0] = X0
+
+        while i < stop:
+            if t[i] > solver.t:
+                solver.step()
+                if solver.status == 'failed':
+                    raise RuntimeError(f"Integration failed at t = {solver.t}.")
+                continue
+            # every output between the last two steps comes from the dense output
+            j = min(np.searchsorted(t, solver.t, side = 'right'), stop)
+            block[i - start:j - start] = solver.dense_output()(t[i:j]).T
+            i = j
+
+        yield t[start:stop], block
+        start = stop
+
+
+def StreamToFile(path, X0, t, a, b, T0, epsilon, om, fi, **kwargs):
+    '''
+    This function streams the solution of StreamSolver() into a .npy file
+    on disk, chunk by chunk, so the memory use does not grow with the horizon.
+    Parameters
+    ----------
+    path : str
+        Output .npy file. It holds the len(t) x 10 solution array.
+    X0, t, a, b, T0, epsilon, om, fi :
+        Same as in DynamicsSolver().
+    **kwargs : optional
+        Options of StreamSolver() (chunk, method, jac, rtol, atol) and additional
+        parameters to pass to Avian().
+
+    Returns
+    -------
+    Solution: array
+        Read-only memory map of the file; rows are loaded lazily when accessed.
+        Later, np.load(path, mmap_mode = 'r') gives the same view.
+    '''
+    out = np.lib.format.open_memmap(path, mode = 'w+', dtype = float, shape = (len(t), 10))
+
+    row = 0
+    for t_chunk, res_chunk in StreamSolver(X0, t, a, b, T0, epsilon, om, fi, **kwargs):
+        out[row:row + len(t_chunk)] = res_chunk
+        out.flush()
+        row += len(t_chunk)
+    del out
+
+    return np.load(path, mmap_mode = 'r')
+
+
+def EventSolver(X0, t, a, b, T0, epsilon, om, fi, extinction = 1e-3, strains = ('HPAI',),
+                periodic_tol = 1e-6, method = 'LSODA', rtol = 1.49012e-8, atol = 1.49012e-8,
+                **kwargs):
+    '''
+    This function solves the ODE system like DynamicsSolver() but stops early
+    when a strain goes extinct or the solution has settled on its annual cycle.
+    The horizon is integrated one forcing period (2*pi/om) at a time. Within a
+    period, a terminal event fires when the infected birds of a strain fall
+    below `extinction`; at the end of each period the state is compared with
+    the state one period earlier.
+    Parameters
+    ----------
+    X0, t, a, b, T0, epsilon, om, fi :
+        Same as in DynamicsSolver().
+    extinction : scalar
+        Extinction threshold on the infected birds of a strain (I1 + I21 for
+        LPAI, I2 + I12 for HPAI). None disables the check. The default is 1e-3.
+    strains : tuple
+        Strains checked for extinction, 'LPAI' and/or 'HPAI'. The default is ('HPAI',).
+    periodic_tol : scalar
+        The run is converged when max |X(t) - X(t - period)| / (|X(t)| + 1) is
+        below periodic_tol. None disables the check. The default is 1e-6.
+    method : str
+        'LSODA' (default), 'BDF' or 'Radau' through scipy.integrate.solve_ivp.
+    rtol, atol : scalar
+        Relative and absolute tolerances. The defaults are those of odeint().
+    **kwargs : optional
+        Additional parameters to pass to Avian().
+
+    Returns
+    -------
+    t_out : array
+        Time points of t reached before stopping.
+    Solution : array
+        Solution at t_out (shape len(t_out) x 10).
+    info : dict
+        'reason' ('HPAI extinct', 'LPAI extinct', 'periodic' or 'end') and
+        't_event', the time at which the run stopped.
+    '''
+    from scipy.integrate import solve_ivp
+
+    compartments = {'LPAI': [1, 6], 'HPAI': [2, 5]}
+    args = (a, b, T0, epsilon, om, fi)
+    t = np.asarray(t, dtype = float)
+    period = 2*np.pi/om
+
+    rhs = lambda tt, X: Avian(X, tt, *args, **kwargs)
+    jac = lambda tt, X: AvianJacobian(X, tt, *args, **kwargs)
+
+    events = []
+    if extinction is not None:
+        for strain in strains:
+            def event(tt, X, idx = compartments[strain]):
+                return X[idx].sum() - extinction
+            event.terminal, event.direction = True, -1
+            events.append(event)
+
+    X = np.asarray(X0, dtype = float)
+    out_t, out = [t[:1]], [X[None]]
+    start, i, k = t[0], 1, 1
+
+    while start < t[-1]:
+        # periods are counted from t[0], so their ends do not drift by rounding
+        end = t[0] + k*period
+        stop = min(end, t[-1])
+        j = np.searchsorted(t, stop, side = 'right')
+
+        # the end of the period is always evaluated, for the next period and the comparison
+        t_eval = t[i:j]
+        extra = len(t_eval) == 0 or t_eval[-1] != stop
+        if extra:
+            t_eval = np.append(t_eval, stop)
+
+        sol = solve_ivp(rhs, (start, stop), X, method = method, t_eval = t_eval, jac = jac,
+                        events = events or None, rtol = rtol, atol = atol)
+        if not sol.success:
+            raise RuntimeError(sol.message)
+
+        keep = len(sol.t) - 1 if extra and sol.status == 0 else len(sol.t)
+        out_t.append(sol.t[:keep])
+        out.append(sol.y.T[:keep])
+
+        if sol.status == 1:
+            k = next(k for k, te in enumerate(sol.t_events) if len(te))
+            return (np.concatenate(out_t), np.concatenate(out),
+                    {'reason': f"{strains[k]} extinct", 't_event': float(sol.t_events[k][0])})
+
+        X_prev, X = X, sol.y[:, -1]
+        if periodic_tol is not None and end <= t[-1] \
+                and np.max(np.abs(X - X_prev)/(np.abs(X) + 1)) < periodic_tol:
+            return (np.concatenate(out_t), np.concatenate(out),
+                    {'reason': 'periodic', 't_event': float(stop)})
+        start, i, k = stop, j, k + 1
+
+    return np.concatenate(out_t), np.concatenate(out), {'reason': 'end', 't_event': float(t[-1])}
+
+
+def SensitivitySolver(X0, t, a, b, T0, epsilon, om, fi, params = ('beta_d', 'beta_i', 'p1', 'p2',
+                      'gamma', 'eta', 'alpha1', 'alpha2', 'd2', 'a', 'b'),
+                      rtol = 1.49012e-8, atol = 1.49012e-8, S0 = None, **kwargs):
+    '''
+    This function solves the ODE system together with its forward sensitivity
+    equations dS/dt = J S + dF/dp, S = dX/dp, for the selected parameters in
+    one stiff integration. AvianJacobian() and AvianParamJacobian() give J and
+    dF/dp exactly, and odeint() reuses J for every sensitivity block through a
+    banded Jacobian, so the cost grows mildly with the number of parameters
+    instead of needing a perturbed solve per parameter.
+    Parameters
+    ----------
+    X0, t, a, b, T0, epsilon, om, fi :
+        Same as in DynamicsSolver().
+    params : list of str
+        Parameters to differentiate with respect to, see AvianParamJacobian().
+        The default is beta_d, beta_i, p1, p2, gamma, eta, alpha1, alpha2, d2, a, b.
+    rtol, atol : scalar
+        Relative and absolute tolerances of odeint(). The defaults are those of odeint().
+    S0 : array, optional
+        Initial sensitivities dX0/dp of shape (10, len(params)), for initial
+        conditions that depend on the parameters. The default is zero.
+    **kwargs : optional
+        Additional parameters to pass to Avian().
+
+    Returns
+    -------
+    Solution: array
+        Solution array (shape len(t) x 10)
+    Sensitivities: array
+        dX/dp of shape (len(t), 10, len(params))
+    '''
+    from scipy.integrate import odeint
 
-    plt.xlabel('time (days)', fontsize = 20)
-    plt.ylabel('Number of birds', fontsize = 20)
-    plt.legend()
-    plt.tight_layout()
-    plt.show()
+    args = (a, b, T0, epsilon, om, fi)
+    params = list(params)
+    k = len(params)
 
+    def rhs(y, tt):
+        X = y[:10]
+        S = y[10:].reshape(k, 10)   # row j holds dX/dp_j
+        J = AvianJacobian(X, tt, *args, **kwargs)
+        Fp = AvianParamJacobian(X, tt, *args, params, **kwargs)
+        return np.concatenate([Avian(X, tt, *args, **kwargs), (S @ J.T + Fp.T).ravel()])
 
-    fig, ax = plt.subplots(figsize=(10, 8))
-    ax.plot(t, V1, label='LPAI particles in water', color='b')
-    ax.plot(t, V2, label='H5N1 particles in water', color='r')
+    def Dfun(y, tt):
+        # as in _monodromy(), the coupling of S to X is dropped and every block is J
+        J = AvianJacobian(y[:10], tt, *args, **kwargs)
+        return _banded(np.repeat(J[:, :, None], k + 1, axis = 2))
 
-    plt.legend()
-    plt.tight_layout()
-    plt.show()
+    S0 = np.zeros((10, k)) if S0 is None else np.asarray(S0, dtype = float)
+    y0 = np.concatenate([X0, S0.T.ravel()])
+    res, out = odeint(rhs, y0, t, Dfun = Dfun, ml = 9, mu = 9, rtol = rtol, atol = atol,
+                      mxstep = 100000, full_output = True)
+    if out['message'] != 'Integration successful.':
+        raise RuntimeError(out['message'])
 
+    return res[:, :10], res[:, 10:].reshape(len(t), k, 10).transpose(0, 2, 1)
@@ -0,0 +1,154 @@
+import numpy as np
+
+from AIVDynamics import AvianEnsemble, AvianJacobian, DynamicsSolver
+
+# compartments that can be non-zero at each kind of equilibrium
+# [S, I1, I2, R1, R2, I12, I21, R12, V1, V2]
+KINDS = {
+    'disease-free': [0],
+    'LPAI': [0, 1, 3, 8],
+    'HPAI': [0, 2, 4, 9],
+    'coexistence': list(range(10)),
+}
+
+
+def _newton(X, params, kwargs, free, tol, max_iter):
+    '''
+    Batched Newton iterations on the rows of X (N x 10) at constant
+    temperature, over the compartments in `free` only. Steps are shortened so
+    that the free compartments stay positive. Returns the new X and a mask of
+    the rows that converged.
+    '''
+    X = X.copy()
+    N = len(X)
+    converged = np.zeros(N, dtype = bool)
+
+    for _ in range(max_iter):
+        # the fixed compartments must stay at rest too, so the residual covers all of them
+        F = AvianEnsemble(X, 0, *params, **kwargs)
+        with np.errstate(invalid = 'ignore'):
+            converged = np.max(np.abs(F)/(np.abs(X) + 1), axis = 1) < tol
+        F = F[:, free]
+        active = np.flatnonzero(~converged & np.all(np.isfinite(X), axis = 1))
+        if len(active) == 0:
+            break
+
+        sub = lambda v: v[active] if np.ndim(v) else v
+        J = AvianJacobian(X[active].T, 0, *map(sub, params), **{k: sub(v) for k, v in kwargs.items()})
+        J = J[np.ix_(free, free)].transpose(2, 0, 1)
+        try:
+            step = np.linalg.solve(J, -F[active][..., None])[..., 0]
+        except np.linalg.LinAlgError:
+            step = (np.linalg.pinv(J) @ -F[active][..., None])[..., 0]
+
+        # fraction to the boundary: never step further than 90% of the way to zero
+        Xf = X[np.ix_(active, free)]
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            lam = np.where(step < 0, -0.9*Xf/step, np.inf).min(axis = 1)
+        lam = np.minimum(lam, 1.0)[:, None]
+        X[np.ix_(active, free)] = Xf + lam*step
+
+    return X, converged
+
+
+def Equilibria(T, a, b, kind = 'coexistence', X0 = None, tol = 1e-10, max_iter = 50,
+               burn_in = 50*365, **kwargs):
+    '''
+    This function finds the equilibria of Avian() at constant temperatures
+    (epsilon = 0) directly with Newton's method and the exact Jacobian, for
+    many temperatures and parameter sets at once, and classifies their
+    stability by the eigenvalues of the Jacobian.
+    All points are iterated together. Points that do not converge from the
+    initial guess are restarted from the solution of their nearest converged
+    neighbour (in the order given), which continues the branch along sorted
+    temperature or parameter arrays.
+    Parameters
+    ----------
+    T : scalar or array of shape (N,)
+        Constant temperatures.
+    a, b : scalar or array of shape (N,)
+        Slope and intercept of the HPAI viral decay rate.
+    kind : str
+        'disease-free', 'LPAI', 'HPAI' or 'coexistence'. With mutation
+        (alpha1, alpha2 > 0) each strain produces the other, so single-strain
+        equilibria only exist when alpha1 = alpha2 = 0. The default is 'coexistence'.
+    X0 : array, optional
+        Initial guess of shape (10,) or (N, 10). By default the first point is
+        integrated for burn_in days from a small outbreak and its state is
+        used as the guess for all points.
+    tol : scalar
+        Convergence tolerance on max |dX/dt| / (|X| + 1). The default is 1e-10.
+    max_iter : int
+        Maximum number of Newton iterations per pass. The default is 50.
+    burn_in : scalar
+        Length of the integration that provides the default guess. The default
+        is 50 years.
+    **kwargs : optional
+        Additional parameters to pass to Avian(), scalar or array of shape (N,).
+
+    Returns
+    -------
+    X : array
+        Equilibria of shape (N, 10); rows of NaN where Newton's method did not
+        converge to an equilibrium of the requested kind.
+    eigvals : array
+        Eigenvalues of the Jacobian at each equilibrium, shape (N, 10).
+    stable : array
+        True where all eigenvalues have negative real part.
+    '''
+    if kind not in KINDS:
+        raise ValueError(f"Unknown kind {kind!r}, expected one of {list(KINDS)}.")
+    free = KINDS[kind]
+
+    params = [np.asarray(p, dtype = float) for p in (a, b, T)]
+    kwargs = {k: np.asarray(v, dtype = float) for k, v in kwargs.items()}
+    shape = np.broadcast_shapes(*(p.shape for p in params), *(v.shape for v in kwargs.values()),
+                                np.shape(X0)[:-1] if X0 is not None else ())
+    if len(shape) > 1:
+        raise ValueError("Parameters must be scalars or 1-D arrays.")
+    N = shape[0] if shape else 1
+    a, b, T = (np.broadcast_to(p, (N,)) for p in params)
+    kwargs = {k: np.broadcast_to(v, (N,)) for k, v in kwargs.items()}
+    params = (a, b, T, np.zeros(N), np.zeros(N), np.zeros(N))   # a, b, T0, epsilon, om, fi
+
+    if X0 is None:
+        start = np.zeros(10)
+        start[0] = 1e3
+        start[free[1:]] = 1.0
+        if len(free) > 1:
+            first = {k: v[0] for k, v in kwargs.items()}
+            start = DynamicsSolver(start, [0, burn_in], a[0], b[0], T[0], 0, 0, 0,
+                                   plot = False, **first)[-1]
+        X0 = start
+    X = np.array(np.broadcast_to(np.asarray(X0, dtype = float), (N, 10)))
+    fixed = np.setdiff1d(np.arange(10), free)
+    X[:, fixed] = 0
+
+    X, converged = _newton(X, params, kwargs, free, tol, max_iter)
+    ok = converged & np.all(X[:, free] > 0, axis = 1)
+
+    # continuation: restart failed points from their nearest converged neighbour
+    while ok.any() and not ok.all():
+        failed = np.flatnonzero(~ok)
+        good = np.flatnonzero(ok)
+        nearest = good[np.abs(failed[:, None] - good[None, :]).argmin(axis = 1)]
+
+        sub = lambda v: v[failed] if np.ndim(v) else v
+        X_f, conv_f = _newton(X[nearest], tuple(map(sub, params)),
+                              {k: sub(v) for k, v in kwargs.items()}, free, tol, max_iter)
+        ok_f = conv_f & np.all(X_f[:, free] > 0, axis = 1)
+        if not ok_f.any():
+            break
+        X[failed[ok_f]] = X_f[ok_f]
+        ok[failed[ok_f]] = True
+
+    X[~ok] = np.nan
+
+    eigvals = np.full((N, 10), np.nan, dtype = complex)
+    if ok.any():
+        sub = lambda v: v[ok] if np.ndim(v) else v
+        J = AvianJacobian(X[ok].T, 0, *map(sub, params), **{k: sub(v) for k, v in kwargs.items()})
+        eigvals[ok] = np.linalg.eigvals(J.transpose(2, 0, 1))
+    stable = eigvals.real.max(axis = 1) < 0
+
+    return X, eigvals, stable
@@ -0,0 +1,160 @@
+import numpy as np
+
+from AIVDynamics import AvianEnsemble, AvianJacobian, _banded
+
+BIRDS = np.arange(8)     # S, I1, I2, R1, R2, I12, I21, R12
+VIRUS = np.arange(8, 10)  # V1, V2
+
+
+def _laplacian(movement):
+    '''
+    Generator of the movement process: movement[i, j] is the rate at which
+    individuals at site j move to site i, and each column loses what it sends.
+    '''
+    from scipy import sparse
+
+    M = sparse.csr_matrix(movement, dtype = float)
+    M.setdiag(0)
+    M.eliminate_zeros()
+    return (M - sparse.diags(np.asarray(M.sum(axis = 0)).ravel())).tocsr()
+
+
+def _coupling(movement, virus_movement):
+    '''
+    Sparse matrix of the movement terms for the flattened state, in which the
+    10 compartments of site i are entries 10*i ... 10*i + 9.
+    '''
+    from scipy import sparse
+
+    birds = np.zeros(10)
+    birds[BIRDS] = 1
+    C = sparse.kron(_laplacian(movement), sparse.diags(birds), format = 'csr')
+    if virus_movement is not None:
+        virus = np.zeros(10)
+        virus[VIRUS] = 1
+        C = C + sparse.kron(_laplacian(virus_movement), sparse.diags(virus), format = 'csr')
+    return C
+
+
+def MetapopulationRHS(X, t, a, b, T0, epsilon, om, fi, coupling, **kwargs):
+    '''
+    Right-hand side of the metapopulation model: Avian() at every site plus
+    the movement terms.
+    Parameters
+    ----------
+    X : array
+        State of shape (n_sites, 10).
+    t : scalar
+        Current time.
+    a, b, T0, epsilon, om, fi : scalar or array of shape (n_sites,)
+        Same as in Avian(), given once or per site.
+    coupling : sparse matrix
+        Movement terms of the flattened state, see MetapopulationSolver().
+    **kwargs : optional
+        Additional parameters of Avian(), scalar or array of shape (n_sites,),
+        e.g. a TemperatureSeries temp with one column per site.
+
+    Returns
+    -------
+    Array of shape (n_sites, 10)
+    '''
+    local = AvianEnsemble(X, t, a, b, T0, epsilon, om, fi, **kwargs)
+    return local + (coupling @ X.ravel()).reshape(X.shape)
+
+
+def MetapopulationJacobian(X, t, a, b, T0, epsilon, om, fi, coupling, **kwargs):
+    '''
+    Sparse Jacobian of MetapopulationRHS() for the flattened state: the exact
+    AvianJacobian() of every site on the block diagonal plus the movement terms.
+    '''
+    from scipy import sparse
+
+    n = len(X)
+    J = AvianJacobian(np.asarray(X).T, t, a, b, T0, epsilon, om, fi, **kwargs)
+    J = np.broadcast_to(J, (10, 10, n)).transpose(2, 0, 1)
+    blocks = sparse.bsr_matrix((J, np.arange(n), np.arange(n + 1)), shape = (10*n, 10*n))
+    return (blocks + coupling).tocsc()
+
+
+def MetapopulationSolver(X0, t, a, b, T0, epsilon, om, fi, movement, virus_movement = None,
+                         method = 'odeint', rtol = 1e-6, atol = 1e-6, **kwargs):
+    '''
+    This function solves the ODE system for a network of wetlands connected by
+    bird movement. Every site follows Avian() with its own parameters and
+    temperature, and birds of all eight host compartments (and optionally the
+    virus in the water, e.g. along a river) move between sites at the rates of
+    a sparse movement matrix. The right-hand side is evaluated for all sites
+    at once.
+    With method = 'odeint' the stiff solver only gets the exact Jacobian of
+    every site, as a banded matrix like in EnsembleSolver(); movement is slow
+    compared with the stiff within-site dynamics, so this approximate
+    Jacobian is enough and the cost stays linear in the number of sites even
+    on densely connected networks. 'BDF' and 'Radau' use the full sparse
+    Jacobian, including the movement terms, which suits small or strongly
+    coupled networks; its factorisation fills in on well-connected graphs.
+    Parameters
+    ----------
+    X0 : array
+        Initial conditions of shape (10,) shared by all sites or (n_sites, 10).
+    t : array
+        Time period of the dynamics.
+    a, b, T0, epsilon, om, fi : scalar or array of shape (n_sites,)
+        Same as in DynamicsSolver(), given once or per site.
+    movement : array or sparse matrix
+        Matrix of shape (n_sites, n_sites); movement[i, j] is the daily rate at
+        which birds at site j move to site i. The diagonal is ignored.
+    virus_movement : array or sparse matrix, optional
+        Same for the virus in the water. The default (None) keeps it in place.
+    method : str
+        'odeint', or 'BDF' and 'Radau' through scipy.integrate.solve_ivp.
+        The default is 'odeint'.
+    rtol, atol : scalar
+        Relative and absolute tolerances. The defaults are 1e-6.
+    **kwargs : optional
+        Additional parameters to pass to Avian(), scalar or array of shape
+        (n_sites,), or a temperature source temp with one column per site.
+
+    Returns
+    -------
+    Solution: array
+        Solution array of shape (n_sites, len(t), 10)
+    '''
+    n = movement.shape[0]
+    X0 = np.array(np.broadcast_to(np.asarray(X0, dtype = float), (n, 10)))
+    coupling = _coupling(movement, virus_movement)
+    args = (a, b, T0, epsilon, om, fi, coupling)
+    t = np.asarray(t, dtype = float)
+
+    if method == 'odeint':
+        from scipy.integrate import odeint
+
+        def rhs(y, tt):
+            return MetapopulationRHS(y.reshape(n, 10), tt, *args, **kwargs).ravel()
+
+        def Dfun(y, tt):
+            J = AvianJacobian(y.reshape(n, 10).T, tt, a, b, T0, epsilon, om, fi, **kwargs)
+            return _banded(np.broadcast_to(J, (10, 10, n)))
+
+        res, out = odeint(rhs, X0.ravel(), t, Dfun = Dfun, ml = 9, mu = 9, rtol = rtol, atol = atol,
+                          mxstep = 100000, full_output = True)
+        if out['message'] != 'Integration successful.':
+            raise RuntimeError(out['message'])
+        return res.reshape(len(t), n, 10).transpose(1, 0, 2)
+
+    if method not in ('BDF', 'Radau'):
+        raise ValueError(f"Unknown method {method!r}, expected 'odeint', 'BDF' or 'Radau'.")
+
+    from scipy.integrate import solve_ivp
+
+    def rhs(tt, y):
+        return MetapopulationRHS(y.reshape(n, 10), tt, *args, **kwargs).ravel()
+
+    def jac(tt, y):
+        return MetapopulationJacobian(y.reshape(n, 10), tt, *args, **kwargs)
+
+    sol = solve_ivp(rhs, (t[0], t[-1]), X0.ravel(), method = method, t_eval = t, jac = jac,
+                    rtol = rtol, atol = atol)
+    if not sol.success:
+        raise RuntimeError(sol.message)
+
+    return sol.y.reshape(n, 10, len(t)).transpose(0, 2, 1)
@@ -0,0 +1,176 @@
+import numpy as np
+
+from AIVDynamics import Temp
+
+PHASE = (1, 2, 8, 9)      # I1, I2, V1, V2
+
+
+class MetricsAccumulator:
+    '''
+    Online summary metrics of trajectories of Avian(), for many runs at once.
+    Feed the solution in consecutive time chunks with update() (e.g. from
+    StreamSolver() or a loop over EnsembleSolver() segments) and read the
+    metrics with result(); every chunk is reduced in one vectorized pass and
+    only a few numbers per run are kept, so the full trajectories are never
+    held in memory. Integrals use the trapezoid rule, also across chunks.
+    The metrics of every run are
+    - peak prevalence of I1 and I2 and the time of the peak,
+    - annual attack rates of LPAI and HPAI: new infections in the year over
+      the mean number of birds in it,
+    - annual HPAI-attributable deaths, the integral of d2*(I2 + I12 + R1),
+    - lowest and highest viral loads V1 and V2,
+    - seasonal phase lags of I1, I2, V1 and V2 behind the temperature, from
+      the first Fourier harmonic at frequency om (exact over whole periods).
+    Parameters
+    ----------
+    T0, epsilon, om, fi : scalar
+        Same as in Temp(); om also sets the period of the phase lags.
+    temp : callable, optional
+        Measured temperature source replacing Temp(), see AIVDynamics.DecayRates().
+    year : scalar
+        Length of a year for the annual metrics in days. The default is 365.
+    beta_d, beta_i, d2, alpha1, alpha2 : scalar or array of shape (n_runs,)
+        Same as in Avian(), for the incidence and deaths.
+    '''
+
+    def __init__(self, T0, epsilon, om, fi, temp = None, year = 365, beta_d = 2.13e-9,
+                 beta_i = 3.55e-9, d2 = 0.88, alpha1 = 0.065, alpha2 = 0.065):
+        self.args = (T0, epsilon, om, fi)
+        self.om = om
+        self.temp = temp
+        self.year = year
+        self.params = {k: np.atleast_1d(np.asarray(v, dtype = float))[:, None]
+                       for k, v in dict(beta_d = beta_d, beta_i = beta_i, d2 = d2,
+                                        alpha1 = alpha1, alpha2 = alpha2).items()}
+        self.t_start = None
+        self.last = None       # last time and integrands, to join chunks
+
+    def _temperature(self, t):
+        if self.temp is None:
+            return Temp(t, *self.args)
+        return self.temp(t)
+
+    def _rates(self, t, X):
+        '''
+        Integrands (n_runs, len(t), k): LPAI and HPAI incidence, HPAI deaths,
+        birds, and the Fourier integrands of the phase compartments and of
+        the temperature.
+        '''
+        p = self.params
+        S, I1, I2, R1, R2, I12, I21, R12, V1, V2 = np.moveaxis(X, -1, 0)
+        L1 = p['beta_i']*V1 + p['beta_d']*(I1 + I21)
+        L2 = p['beta_i']*V2 + p['beta_d']*(I2 + I12)
+        H1 = p['beta_d']*(I1 + V1 + I21)
+        H2 = p['beta_d']*(I2 + V2 + I12)
+
+        # new infections flowing into I1 and I21 (LPAI), I2 and I12 (HPAI), as in Avian()
+        lpai = (S*((1 - p['alpha1'])*L1 + p['alpha2']*H2)
+                + R2*((1 - p['alpha1'])*L1 + p['alpha2']*L2))
+        hpai = (S*((1 - p['alpha2'])*L2 + p['alpha1']*H1)
+                + R1*((1 - p['alpha2'])*L2 + p['alpha1']*L1))
+        deaths = p['d2']*(I2 + I12 + R1)
+        birds = X[..., :8].sum(axis = -1)
+
+        wave = np.exp(-1j*self.om*t)
+        fourier = X[..., PHASE]*wave[:, None]
+        # a temperature series with one column per site gives one row per run
+        temperature = np.broadcast_to(np.atleast_2d(np.transpose(self._temperature(t)))*wave,
+                                      birds.shape)
+        return (np.stack([lpai, hpai, deaths, birds], axis = -1),
+                np.concatenate([fourier, temperature[..., None]], axis = -1))
+
+    def update(self, t, X):
+        '''
+        Add the next chunk: times t and states X of shape (n_runs, len(t), 10),
+        or (len(t), 10) for a single run. Chunks must follow each other in time.
+        '''
+        t = np.asarray(t, dtype = float)
+        X = np.asarray(X, dtype = float)
+        if X.ndim == 2:
+            X = X[None]
+        if len(t) == 0:
+            return
+        n = len(X)
+
+        if self.t_start is None:
+            self.t_start = t[0]
+            self.peak = np.full((n, 2), -np.inf)
+            self.peak_time = np.zeros((n, 2))
+            self.V_min = np.full((n, 2), np.inf)
+            self.V_max = np.full((n, 2), -np.inf)
+            self.annual = {}
+            self.harmonic = np.zeros((n, len(PHASE) + 1), dtype = complex)
+
+        # extremes of the chunk
+        I = X[:, :, [1, 2]]
+        k = I.argmax(axis = 1)
+        top = np.take_along_axis(I, k[:, None], axis = 1)[:, 0]
+        higher = top > self.peak
+        self.peak = np.where(higher, top, self.peak)
+        self.peak_time = np.where(higher, t[k], self.peak_time)
+        self.V_min = np.minimum(self.V_min, X[:, :, 8:].min(axis = 1))
+        self.V_max = np.maximum(self.V_max, X[:, :, 8:].max(axis = 1))
+
+        # integrals, joined to the last point of the previous chunk
+        rates, fourier = self._rates(t, X)
+        if self.last is not None:
+            t = np.concatenate([[self.last[0]], t])
+            rates = np.concatenate([self.last[1], rates], axis = 1)
+            fourier = np.concatenate([self.last[2], fourier], axis = 1)
+        self.last = (t[-1], rates[:, -1:], fourier[:, -1:])
+        if len(t) < 2:
+            return
+
+        h = np.diff(t)
+        self.harmonic += (h[:, None]*(fourier[:, 1:] + fourier[:, :-1])/2).sum(axis = 1)
+
+        # every interval counts for the year of its midpoint
+        steps = h[:, None]*(rates[:, 1:] + rates[:, :-1])/2
+        years = np.floor(((t[1:] + t[:-1])/2 - self.t_start)/self.year).astype(int)
+        for y in np.unique(years):
+            inside = years == y
+            total = np.column_stack([steps[:, inside].sum(axis = 1), np.full(n, h[inside].sum())])
+            self.annual[y] = self.annual.get(y, 0) + total
+
+    def result(self):
+        '''
+        Metrics of every run as a dict of arrays:
+        'peak' and 'peak_time' of I1 and I2 (n_runs x 2);
+        'years', the start time of each year;
+        'attack_rate' of LPAI and HPAI (n_runs x n_years x 2) and
+        'hpai_deaths' (n_runs x n_years) by year, where the last year may be partial;
+        'V_min' and 'V_max' of V1 and V2 (n_runs x 2);
+        'phase_lag' of I1, I2, V1 and V2 behind the temperature in days,
+        between 0 and one period (n_runs x 4).
+        '''
+        if self.t_start is None:
+            raise RuntimeError("No data, call update() first.")
+        years = sorted(self.annual)
+        annual = np.stack([self.annual[y] for y in years], axis = 1)
+        incidence, deaths = annual[..., :2], annual[..., 2]
+        birds = annual[..., 3]/annual[..., 4]     # mean number of birds in the year
+
+        # x ~ cos(om*t - phi) has harmonic exp(-1j*phi); the lag is (phi_x - phi_T)/om
+        phase = -np.angle(self.harmonic)
+        period = 2*np.pi/self.om
+        lag = np.mod((phase[:, :-1] - phase[:, -1:])/self.om, period)
+
+        return {'peak': self.peak, 'peak_time': self.peak_time,
+                'years': self.t_start + self.year*np.array(years),
+                'attack_rate': incidence/birds[..., None],
+                'hpai_deaths': deaths, 'V_min': self.V_min, 'V_max': self.V_max,
+                'phase_lag': lag}
+
+
+def SummaryMetrics(t, X, T0, epsilon, om, fi, **kwargs):
+    '''
+    Metrics of MetricsAccumulator() for whole trajectories X of shape
+    (n_runs, len(t), 10), e.g. from EnsembleSolver(), or (len(t), 10) for one
+    run (then without the leading run axis).
+    '''
+    acc = MetricsAccumulator(T0, epsilon, om, fi, **kwargs)
+    acc.update(t, X)
+    metrics = acc.result()
+    if np.ndim(X) == 2:
+        metrics = {k: (v if k == 'years' else v[0]) for k, v in metrics.items()}
+    return metrics
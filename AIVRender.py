@@ -0,0 +1,84 @@
+import os
+
+from AIVDynamics import DynamicsSolver, PlotDynamics
+
+
+def RenderScenario(scenario, out_dir, fmt = 'png', dpi = 100):
+    '''
+    Solve one scenario without plotting and write its three dynamics figures
+    to out_dir. The figures are drawn on their own Agg canvases outside
+    pyplot, so the matplotlib backend of the caller is left alone.
+    Parameters
+    ----------
+    scenario : dict
+        Arguments of DynamicsSolver() (X0, t, a, b, T0, epsilon, om, fi and any
+        Avian() parameters), plus an optional 'name' used in the file names and an
+        optional precomputed solution 'res' (shape len(t) x 10) to skip solving.
+    out_dir : str
+        Output directory.
+    fmt : str
+        'png' or 'svg'. The default is 'png'.
+    dpi : int
+        Resolution; curves are downsampled to the width of the figure in pixels.
+        The default is 100.
+
+    Returns
+    -------
+    paths : list of the three written files
+    '''
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    scenario = dict(scenario)
+    name = scenario.pop('name', 'scenario')
+    res = scenario.pop('res', None)
+    if res is None:
+        res = DynamicsSolver(plot = False, **scenario)
+
+    figs = PlotDynamics(scenario['t'], res, max_points = 10*dpi, pyplot = False)
+
+    paths = []
+    for k, fig in enumerate(figs, start = 1):
+        path = os.path.join(out_dir, f"{name}_{k}.{fmt}")
+        FigureCanvasAgg(fig)
+        fig.savefig(path, dpi = dpi)
+        paths.append(path)
+    return paths
+
+
+def RenderBatch(scenarios, out_dir, fmt = 'png', dpi = 100, processes = None):
+    '''
+    Write the dynamics figures of many scenarios in parallel worker processes.
+    Each worker solves its scenario headless (DynamicsSolver(plot = False)),
+    downsamples the curves to pixel resolution with Decimate() and saves the
+    figures from Agg canvases outside pyplot, so nothing blocks on plt.show()
+    and no backend is switched.
+    Parameters
+    ----------
+    scenarios : list of dict
+        Scenarios as accepted by RenderScenario(). Scenarios without a 'name'
+        are named scenario_0, scenario_1, ...
+    out_dir : str
+        Output directory, created if needed.
+    fmt : str
+        'png' or 'svg'. The default is 'png'.
+    dpi : int
+        Resolution of the figures. The default is 100.
+    processes : int, optional
+        Number of worker processes. The default uses all cores; 1 renders in
+        the calling process.
+
+    Returns
+    -------
+    paths : list with the written files of every scenario
+    '''
+    os.makedirs(out_dir, exist_ok = True)
+    scenarios = [{'name': f"scenario_{k}", **s} for k, s in enumerate(scenarios)]
+
+    if processes == 1:
+        return [RenderScenario(s, out_dir, fmt, dpi) for s in scenarios]
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    n = len(scenarios)
+    with ProcessPoolExecutor(max_workers = processes) as pool:
+        return list(pool.map(RenderScenario, scenarios, [out_dir]*n, [fmt]*n, [dpi]*n))
@@ -0,0 +1,234 @@
+import json
+import os
+
+import numpy as np
+
+from AIVDynamics import EnsembleSolver
+from R0_calc import R0Grid
+
+
+def Sample(bounds, n, method = 'sobol', seed = 0, start = 0):
+    '''
+    Points of a Sobol sequence or a Latin hypercube, scaled to the parameter
+    bounds. Sobol points are the n points that follow the first `start` points
+    of one scrambled sequence, so consecutive calls extend the same design.
+    Latin hypercubes cannot be extended; every block (start, n) is then its own
+    hypercube with a seed derived from seed and start.
+    Parameters
+    ----------
+    bounds : dict
+        {name: (low, high)} of uniformly distributed parameters.
+    n : int
+        Number of points.
+    method : str
+        'sobol' or 'lhs'. The default is 'sobol'.
+    seed : int
+        Seed of the scrambling. The default is 0.
+    start : int
+        Index of the first point. The default is 0.
+
+    Returns
+    -------
+    Array of shape (n, len(bounds))
+    '''
+    from scipy.stats import qmc
+
+    k = len(bounds)
+    if method == 'sobol':
+        sampler = qmc.Sobol(k, seed = seed)
+        if start:
+            sampler.fast_forward(start)
+        u = sampler.random(n)
+    elif method == 'lhs':
+        u = qmc.LatinHypercube(k, seed = np.random.default_rng([seed, start])).random(n)
+    else:
+        raise ValueError(f"Unknown method {method!r}, expected 'sobol' or 'lhs'.")
+
+    low, high = np.array(list(bounds.values()), dtype = float).T
+    return low + u*(high - low)
+
+
+def R0Model(**params):
+    '''
+    LPAI, HPAI and coexistence R0 from R0_calc.R0Grid() for arrays of
+    parameters. Returns an array of shape (n, 3).
+    '''
+    return np.stack(R0Grid(**params), axis = -1)
+
+
+def BurdenModel(a = 0.0587, b = 3.6348, T0 = 5.73, epsilon = 1.91, om = 2*np.pi/365, fi = 92.3,
+                X0 = (7000, 10, 10, 0, 0, 0, 0, 0, 1e3, 1e3), years = 1, d2 = 0.88, **params):
+    '''
+    HPAI burden of Avian() for arrays of parameters, solved together with
+    EnsembleSolver(). Returns an array of shape (n, 2) with the peak HPAI
+    prevalence max(I2 + I12) and the mean annual number of HPAI deaths,
+    the integral of d2*(I2 + I12 + R1), over the given number of years.
+    '''
+    from scipy.integrate import trapezoid
+
+    t = np.arange(0, 365*years + 1, dtype = float)
+    res = EnsembleSolver(X0, t, a, b, T0, epsilon, om, fi, d2 = d2, **params)
+    I2, R1, I12 = res[..., 2], res[..., 3], res[..., 5]
+
+    peak = np.max(I2 + I12, axis = 1)
+    deaths = trapezoid(np.asarray(d2)[..., None]*(I2 + I12 + R1), t, axis = 1)/years
+    return np.stack([peak, deaths], axis = -1)
+
+
+def _sobol_batch(model, bounds, fixed, batch, j, method, seed):
+    '''
+    Evaluate the model on batch j of the Saltelli design: matrices A and B
+    from a 2k-dimensional sample, and A with its i-th column taken from B for
+    every parameter i, all in one vectorized call. Returns the additive sums
+    of the estimators.
+    '''
+    names = list(bounds)
+    k = len(names)
+    AB = Sample({**{f"A{n}": bounds[n] for n in names}, **{f"B{n}": bounds[n] for n in names}},
+                batch, method, seed, j*batch)
+    A, B = AB[:, :k], AB[:, k:]
+
+    X = np.concatenate([A, B] + [np.where(np.arange(k) == i, B, A) for i in range(k)])
+    f = np.asarray(model(**{n: X[:, i] for i, n in enumerate(names)}, **fixed), dtype = float)
+    f = f.reshape(k + 2, batch, -1)
+    fA, fB, fAB = f[0], f[1], f[2:]
+
+    # mean and sum of squared deviations of all fA and fB values, for the variance
+    fAll = np.concatenate([fA, fB])
+    mean = fAll.mean(axis = 0)
+    return {'count': np.array(2*batch), 'mean': mean, 'M2': ((fAll - mean)**2).sum(axis = 0),
+            'first': (fB*(fAB - fA)).sum(axis = 1), 'total': ((fA - fAB)**2).sum(axis = 1)}
+
+
+def _merge(acc, part):
+    '''Add the sums of one batch to the accumulator (Chan et al. for the variance).'''
+    if acc is None:
+        return {k: np.array(v, dtype = float) for k, v in part.items()}
+    n_a, n_b = acc['count'], part['count']
+    delta = part['mean'] - acc['mean']
+    n = n_a + n_b
+    return {'count': n,
+            'mean': acc['mean'] + delta*n_b/n,
+            'M2': acc['M2'] + part['M2'] + delta**2*n_a*n_b/n,
+            'first': acc['first'] + part['first'],
+            'total': acc['total'] + part['total']}
+
+
+def _model_name(model):
+    '''
+    Name of a model that is the same in every process: module and qualified
+    name of the function, and the arguments of a functools.partial (whose
+    repr holds a memory address).
+    '''
+    import functools
+
+    if isinstance(model, functools.partial):
+        return {'model': _model_name(model.func), 'args': [repr(v) for v in model.args],
+                'keywords': {k: repr(v) for k, v in model.keywords.items()}}
+    name = getattr(model, '__qualname__', None) or getattr(model, '__name__', None)
+    if name is None:
+        return repr(model)
+    return f"{getattr(model, '__module__', '')}.{name}"
+
+
+def SobolIndices(model, bounds, n, batch = 1024, method = 'sobol', seed = 0, processes = None,
+                 checkpoint = None, full_output = False, **fixed):
+    '''
+    This function estimates first-order and total Sobol indices of a
+    vectorized model with the Saltelli design, in n*(k + 2) model evaluations
+    for k parameters. The design is generated and evaluated batch by batch in
+    worker processes, and only running sums of the estimators (Saltelli 2010
+    for the first-order, Jansen for the total indices) are kept, so memory
+    does not depend on n. With a checkpoint file the sums are saved after
+    every batch and a repeated call only evaluates the missing batches.
+    Parameters
+    ----------
+    model : callable
+        model(**params) returning an array of shape (m,) or (m, n_outputs) for
+        parameter arrays of length m, e.g. R0Model or BurdenModel. It must be
+        picklable (a module-level function or functools.partial) to run in
+        worker processes.
+    bounds : dict
+        {name: (low, high)} of the uniformly distributed parameters.
+    n : int
+        Number of base samples, rounded up to a multiple of batch. Powers of 2
+        keep the Sobol design balanced.
+    batch : int
+        Base samples per batch; each batch makes batch*(k + 2) evaluations.
+        The default is 1024.
+    method : str
+        'sobol' or 'lhs', see Sample(). The default is 'sobol'.
+    seed : int
+        Seed of the design. The default is 0.
+    processes : int, optional
+        Number of worker processes. The default uses all cores; 1 evaluates in
+        the calling process.
+    checkpoint : str, optional
+        Path of an .npz file with the partial sums. The default (None) keeps
+        them in memory only.
+    full_output : bool
+        Also return a dict with the mean and variance of the outputs and the
+        number of base samples. The default is False.
+    **fixed : optional
+        Parameters passed unchanged to every model call.
+
+    Returns
+    -------
+    S1 : array
+        First-order indices of shape (k, n_outputs).
+    ST : array
+        Total indices of shape (k, n_outputs).
+    '''
+    n_batches = -(-n//batch)
+    settings = json.dumps({'model': _model_name(model),
+                           'bounds': {k: list(map(float, v)) for k, v in bounds.items()},
+                           'batch': batch, 'method': method, 'seed': seed,
+                           'fixed': {k: repr(v) for k, v in fixed.items()}}, sort_keys = True)
+
+    acc, done = None, np.zeros(n_batches, dtype = bool)
+    if checkpoint is not None and os.path.exists(checkpoint):
+        saved = np.load(checkpoint)
+        if str(saved['settings']) != settings:
+            raise ValueError(f"{checkpoint} holds a run with different settings.")
+        if len(saved['done']) > n_batches:
+            raise ValueError(f"{checkpoint} holds more batches than n = {n} requires.")
+        done[:len(saved['done'])] = saved['done']
+        if done.any():
+            acc = {k: saved[k] for k in ('count', 'mean', 'M2', 'first', 'total')}
+
+    def save():
+        tmp = checkpoint + '.tmp.npz'
+        np.savez(tmp, settings = settings, done = done, **acc)
+        os.replace(tmp, checkpoint)
+
+    todo = [j for j in range(n_batches) if not done[j]]
+    args = (model, bounds, fixed, batch)
+
+    if processes == 1:
+        results = ((j, _sobol_batch(*args, j, method, seed)) for j in todo)
+        pool = None
+    else:
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+
+        pool = ProcessPoolExecutor(max_workers = processes)
+        futures = {pool.submit(_sobol_batch, *args, j, method, seed): j for j in todo}
+        results = ((futures[f], f.result()) for f in as_completed(futures))
+
+    try:
+        for j, part in results:
+            acc = _merge(acc, part)
+            done[j] = True
+            if checkpoint is not None:
+                save()
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures = True)
+
+    N = acc['count']/2
+    var = acc['M2']/(acc['count'] - 1)
+    S1 = acc['first']/N/var
+    ST = acc['total']/(2*N)/var
+
+    if full_output:
+        return S1, ST, {'mean': acc['mean'], 'var': var, 'n': int(N)}
+    return S1, ST
@@ -0,0 +1,200 @@
+import numpy as np
+
+from AIVDynamics import DecayRates
+
+# birds infected with LPAI (I1, I21) and with HPAI (I2, I12)
+INFECTED = ([1, 6], [2, 5])
+
+
+def _split(rng, count, rates, h):
+    '''
+    Number of individuals leaving a compartment through each of its channels
+    during a step h, drawn in one multinomial per replicate: a channel is
+    taken with probability h times its per-capita rate, as in an Euler step
+    of Avian(), and the rest stay. Where the rates sum to more than 1/h the
+    probabilities are scaled down to sum to 1, so counts never become negative.
+    '''
+    p = np.stack(np.broadcast_arrays(*rates, count), axis = -1)[:, :-1]*h
+    p /= np.maximum(p.sum(axis = 1, keepdims = True), 1)
+    pvals = np.column_stack([p, np.maximum(1 - p.sum(axis = 1), 0)])
+    return list(rng.multinomial(count, pvals)[:, :-1].T)
+
+
+def _tau_block(X0, t, n, seed, tau, v_threshold, args, params):
+    '''
+    Simulate n replicates with one random stream and return their summary
+    statistics: mean and sum of squared deviations of every compartment at
+    the output times, the number of replicates in which each strain has faded
+    out by then, the fade-out times and the peaks of every replicate.
+    '''
+    a, b, T0, epsilon, om, fi, temp = args
+    beta_d, beta_i, d, d2, p1, p2, gamma, lambd, eta, alpha1, alpha2 = params
+    rng = np.random.default_rng(seed)
+
+    N = np.zeros((n, 8), dtype = np.int64)
+    N[:] = np.rint(X0[:8]).astype(np.int64)
+    V = np.tile(np.asarray(X0[8:], dtype = float), (n, 1))
+
+    mean = np.zeros((len(t), 10))
+    M2 = np.zeros((len(t), 10))
+    extinct = np.zeros((len(t), 2))
+    t_ext = np.full((n, 2), np.inf)
+    peak = np.zeros((n, 10))
+
+    def record(k):
+        X = np.hstack([N, V])
+        mean[k] = X.mean(axis = 0)
+        M2[k] = ((X - mean[k])**2).sum(axis = 0)
+        np.maximum(peak, X, out = peak)
+        extinct[k] = np.isfinite(t_ext).sum(axis = 0)
+
+    def fade(tt):
+        for s in range(2):
+            gone = (N[:, INFECTED[s]].sum(axis = 1) == 0) & (V[:, s] < v_threshold)
+            t_ext[gone & np.isinf(t_ext[:, s]), s] = tt
+
+    fade(t[0])
+    record(0)
+    for k in range(1, len(t)):
+        steps = max(int(np.ceil((t[k] - t[k - 1])/tau - 1e-9)), 1)
+        h = (t[k] - t[k - 1])/steps
+        for j in range(steps):
+            tt = t[k - 1] + j*h
+            S, I1, I2, R1, R2, I12, I21, R12 = N.T.copy()
+            V1, V2 = V.T
+
+            # forces of infection and mutation terms as in Avian()
+            L1 = beta_i*V1 + beta_d*(I1 + I21)
+            L2 = beta_i*V2 + beta_d*(I2 + I12)
+            H1 = beta_d*(I1 + V1 + I21)
+            H2 = beta_d*(I2 + V2 + I12)
+
+            to_I1 = (1 - alpha1)*L1 + alpha2*H2
+            to_I2 = (1 - alpha2)*L2 + alpha1*H1
+            # Avian() removes S at L1 + L2, more than the infections above;
+            # the excess leaves the population together with natural deaths
+            lost = np.maximum(L1 + L2 - to_I1 - to_I2, 0) + d
+
+            sS = _split(rng, S, [to_I1, to_I2, lost], h)
+            sI1 = _split(rng, I1, [gamma, d], h)
+            sI2 = _split(rng, I2, [gamma, d + d2], h)
+            sR1 = _split(rng, R1, [(1 - alpha2)*L2 + alpha1*L1, eta + 0*L1, d + d2], h)
+            sR2 = _split(rng, R2, [(1 - alpha1)*L1 + alpha2*L2, eta + 0*L1, d], h)
+            sI12 = _split(rng, I12, [gamma, d + d2], h)
+            sI21 = _split(rng, I21, [gamma, d], h)
+            sR12 = _split(rng, R12, [eta, d], h)
+            births = rng.poisson(lambd*h, n)
+
+            N[:, 0] += births + sR1[1] + sR2[1] + sR12[0] - sum(sS)
+            N[:, 1] += sS[0] - sum(sI1)
+            N[:, 2] += sS[1] - sum(sI2)
+            N[:, 3] += sI1[0] - sum(sR1)
+            N[:, 4] += sI2[0] - sum(sR2)
+            N[:, 5] += sR1[0] - sum(sI12)
+            N[:, 6] += sR2[0] - sum(sI21)
+            N[:, 7] += sI12[0] + sI21[0] - sum(sR12)
+
+            # viral load: exact solution of the linear shedding-decay equation over the step
+            w = np.array(DecayRates(tt + h/2, a, b, T0, epsilon, om, fi, temp), dtype = float)
+            shed = np.stack([p1*(I1 + I21), p2*(I2 + I12)], axis = 1)
+            decay = np.exp(-w*h)
+            V = V*decay + shed/w*(1 - decay)
+
+            fade(tt + h)
+        record(k)
+
+    return {'count': n, 'mean': mean, 'M2': M2, 'extinct': extinct,
+            't_ext': t_ext, 'peak': peak}
+
+
+def TauLeapSolver(X0, t, a, b, T0, epsilon, om, fi, n_rep = 1000, tau = 0.25, seed = 0,
+                  block = 1024, processes = 1, v_threshold = 1.0, temp = None,
+                  beta_d = 2.13e-9, beta_i = 3.55e-9, d = 0.1/365, d2 = 0.88, p1 = 1e3, p2 = 1e4,
+                  gamma = 0.14, lambd = 2, eta = 0.038, alpha1 = 0.065, alpha2 = 0.065):
+    '''
+    This function simulates the Avian() compartments as a stochastic process
+    for many replicates at once by multinomial tau-leaping. Birds are whole
+    numbers that are born, die, get infected, recover and lose immunity at
+    the rates of Avian(); in every step the birds of a compartment are split
+    over its exits and staying by one multinomial draw with the
+    probabilities of an Euler step, so the mean follows
+    Avian() and no count turns negative. The viral loads V1 and V2 are large
+    and follow the shedding-decay equation exactly over each step.
+    Replicates are advanced together as arrays, in blocks that each draw from
+    their own random stream spawned from seed, so replicate i gives the same
+    path however the blocks are split over processes. Only summary statistics
+    are kept, never the paths.
+    The cost is proportional to n_rep times the number of steps, a few
+    microseconds per replicate and step on one core: 10^4 replicates over a
+    year at tau = 0.25 take roughly half a minute. Spread the blocks over
+    cores with processes for larger ensembles.
+    Parameters
+    ----------
+    X0 : array
+        Initial conditions [S, I1, I2, R1, R2, I12, I21, R12, V1, V2]; the bird
+        counts are rounded to integers.
+    t : array
+        Output times.
+    a, b, T0, epsilon, om, fi :
+        Same as in DynamicsSolver().
+    n_rep : int
+        Number of replicates. The default is 1000.
+    tau : scalar
+        Largest step in days; tau*(gamma + d + d2) must stay below 1.
+        The default is 0.25.
+    seed : int
+        Seed of the random streams. The default is 0.
+    block : int
+        Replicates per random stream and per vectorized batch. The default is 1024.
+    processes : int
+        Number of worker processes; None uses all cores. The default is 1.
+    v_threshold : scalar
+        A strain has faded out once no bird is infected with it and its viral
+        load is below this value. The default is 1.
+    temp : callable, optional
+        Measured temperature source, see AIVDynamics.DecayRates().
+    beta_d, beta_i, d, d2, p1, p2, gamma, lambd, eta, alpha1, alpha2 : scalar
+        Same as in Avian().
+
+    Returns
+    -------
+    stats : dict
+        'mean' and 'var' of every compartment at the output times (len(t) x 10);
+        'extinct', the fraction of replicates in which LPAI and HPAI have faded
+        out by each output time (len(t) x 2); 'extinction_time', the first
+        fade-out time of each replicate and strain (n_rep x 2, inf if never);
+        'peak', the largest value of every compartment at the output times
+        (n_rep x 10).
+    '''
+    if tau*(gamma + d + d2) >= 1:
+        raise ValueError(f"tau = {tau} is too large, HPAI infections would all end in one step.")
+    t = np.asarray(t, dtype = float)
+    X0 = np.asarray(X0, dtype = float)
+    args = (a, b, T0, epsilon, om, fi, temp)
+    params = (beta_d, beta_i, d, d2, p1, p2, gamma, lambd, eta, alpha1, alpha2)
+
+    sizes = [min(block, n_rep - start) for start in range(0, n_rep, block)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    jobs = [(X0, t, m, s, tau, v_threshold, args, params) for m, s in zip(sizes, seeds)]
+
+    if processes == 1:
+        parts = [_tau_block(*job) for job in jobs]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers = processes) as pool:
+            parts = list(pool.map(_tau_block, *zip(*jobs)))
+
+    # merge the blocks (Chan et al. for the variance)
+    count, mean, M2 = 0, np.zeros((len(t), 10)), np.zeros((len(t), 10))
+    for part in parts:
+        n = part['count']
+        delta = part['mean'] - mean
+        mean = mean + delta*n/(count + n)
+        M2 = M2 + part['M2'] + delta**2*count*n/(count + n)
+        count += n
+
+    return {'t': t, 'mean': mean, 'var': M2/max(count - 1, 1),
+            'extinct': sum(part['extinct'] for part in parts)/count,
+            'extinction_time': np.concatenate([part['t_ext'] for part in parts]),
+            'peak': np.concatenate([part['peak'] for part in parts])}
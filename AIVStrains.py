@@ -0,0 +1,252 @@
+import numpy as np
+
+from AIVDynamics import Temp, Viral
+
+
+class NStrainModel:
+    '''
+    Avian() generalised to n co-circulating strains and assembled from index
+    tensors instead of hand-written equations.
+    A host is described by its immune history h, the set of strains it has
+    recovered from (h = {} is S), and possibly the strain j it is infected
+    with, j not in h. The state holds every recovered class R_h (2**n of them,
+    R_{} = S), every infected class I_hj (n*2**(n - 1)) and the virus V_j in
+    the environment of every strain (n), so n = 2 gives the ten compartments
+    of Avian() and n = 5 gives 117. Infection with strain k produces strain j
+    with probability mutation[j, k], recovery from j leads to R_{h + j}, and
+    every recovered class wanes back to S. The right-hand side, the Jacobian
+    and the next-generation matrices are contractions of the same incidence
+    matrices, so their cost grows with the number of compartments only.
+    Parameters
+    ----------
+    n : int
+        Number of strains.
+    mutation : array, optional
+        Matrix of shape (n, n), column k the distribution of the strain that
+        results from an infection with strain k (columns sum to 1). The default
+        is the identity.
+    cross_immunity : array, optional
+        Matrix of shape (n, n); cross_immunity[i, j] is the protection against
+        strain j after recovery from strain i. Immunity against a strain the
+        host has recovered from is always complete. The default is no cross
+        protection.
+    beta_d, beta_i : scalar
+        Direct and indirect transmission rates. The defaults are 2.13e-9 and 3.55e-9.
+    beta_i_mutant : scalar, optional
+        Indirect transmission rate of primary infections that mutate. Avian()
+        uses beta_d here; the default (None) is beta_i.
+    d : scalar
+        Natural death rate. The default is 0.1/365.
+    d_strain : scalar or array of shape (n,)
+        Disease death rate of hosts infected with each strain. The default is 0.
+    d_recovered : scalar or array of shape (2**n,)
+        Additional death rate of each recovered class, indexed by the bit mask
+        of h. The default is 0.
+    p : scalar or array of shape (n,)
+        Shedding rates. The default is 1e3.
+    gamma, lambd, eta : scalar
+        Recovery, birth and immunity waning rates. The defaults are those of Avian().
+    a, b : scalar or array of shape (n,)
+        Slope and intercept of the viral decay rate of each strain. The
+        defaults are the LPAI values of Avian().
+    '''
+
+    def __init__(self, n, mutation = None, cross_immunity = None, beta_d = 2.13e-9,
+                 beta_i = 3.55e-9, beta_i_mutant = None, d = 0.1/365, d_strain = 0,
+                 d_recovered = 0, p = 1e3, gamma = 0.14, lambd = 2, eta = 0.038,
+                 a = 0.114, b = 3.7594):
+        self.n = n
+        H = 2**n
+        self.mutation = np.eye(n) if mutation is None else np.asarray(mutation, dtype = float)
+        C = np.zeros((n, n)) if cross_immunity is None else np.asarray(cross_immunity, dtype = float)
+        self.beta_d, self.beta_i = beta_d, beta_i
+        self.beta_i_mutant = beta_i if beta_i_mutant is None else beta_i_mutant
+        self.d, self.gamma, self.lambd, self.eta = d, gamma, lambd, eta
+        self.d_strain = np.broadcast_to(np.asarray(d_strain, dtype = float), (n,))
+        self.d_recovered = np.broadcast_to(np.asarray(d_recovered, dtype = float), (H,))
+        self.p = np.broadcast_to(np.asarray(p, dtype = float), (n,))
+        self.a = np.broadcast_to(np.asarray(a, dtype = float), (n,))
+        self.b = np.broadcast_to(np.asarray(b, dtype = float), (n,))
+
+        # infected classes (h, j) with j not in h, as bit masks
+        member = (np.arange(H)[:, None] >> np.arange(n)[None, :]) & 1   # member[h, i] = i in h
+        hist, strain = np.nonzero(member == 0)
+        self.hist, self.strain = hist, strain
+        P = len(hist)
+        self.H, self.P = H, P
+        self.size = H + P + n
+
+        # incidence matrices: infected pair -> its strain, its history, the class it recovers to
+        self.A = np.zeros((n, P))
+        self.A[strain, np.arange(P)] = 1
+        self.Hp = np.zeros((H, P))
+        self.Hp[hist, np.arange(P)] = 1
+        self.Rec = np.zeros((H, P))
+        self.Rec[hist | (1 << strain), np.arange(P)] = 1
+
+        # susceptibility of history h to strain j under cross immunity
+        self.s = np.prod(np.where(member[hist] == 1, 1 - C[:, strain].T, 1), axis = 1)
+
+        # outcome forces G = MI @ Itot + MV @ V: naive hosts use beta_i_mutant for mutations
+        off = self.mutation - np.diag(np.diag(self.mutation))
+        MV0 = np.diag(np.diag(self.mutation))*beta_i + off*self.beta_i_mutant
+        self.GI = beta_d*(self.mutation @ self.A)[strain]                      # (P, P)
+        self.GV = np.where((hist == 0)[:, None], MV0[strain], beta_i*self.mutation[strain])   # (P, n)
+
+        self.labels = (['S'] + [self._name('R', h) for h in range(1, H)]
+                       + [self._name('I', h) + str(j + 1) for h, j in zip(hist, strain)]
+                       + [f"V{j + 1}" for j in range(n)])
+
+    @staticmethod
+    def _name(prefix, h):
+        return prefix + ''.join(str(i + 1) for i in range(int(h).bit_length()) if h >> i & 1)
+
+    @classmethod
+    def avian(cls, a = 0.0587, b = 3.6348, beta_d = 2.13e-9, beta_i = 3.55e-9, d = 0.1/365,
+              d2 = 0.88, p1 = 1e3, p2 = 1e4, gamma = 0.14, lambd = 2, eta = 0.038,
+              alpha1 = 0.065, alpha2 = 0.065):
+        '''
+        The two-strain model of Avian() (strain 1 LPAI, strain 2 HPAI).
+        Reorder a state with index('S', 'I1', 'I2', 'R1', 'R2', 'I12', 'I21',
+        'R12', 'V1', 'V2') to compare with Avian().
+        '''
+        d_recovered = np.zeros(4)
+        d_recovered[1] = d2   # Avian() applies the HPAI death rate to R1
+        return cls(2, mutation = [[1 - alpha1, alpha2], [alpha1, 1 - alpha2]],
+                   beta_d = beta_d, beta_i = beta_i, beta_i_mutant = beta_d, d = d,
+                   d_strain = [0, d2], d_recovered = d_recovered, p = [p1, p2], gamma = gamma,
+                   lambd = lambd, eta = eta, a = [0.114, a], b = [3.7594, b])
+
+    def index(self, *labels):
+        '''Positions of the named compartments in the state.'''
+        return np.array([self.labels.index(name) for name in labels])
+
+    def _split(self, X):
+        H, P = self.H, self.P
+        return X[:H], X[H:H + P], X[H + P:]
+
+    def decay(self, t, T0, epsilon, om, fi, temp = None):
+        '''Viral decay rates of all strains at time t, shape (n,) + t.shape.'''
+        current_temp = Temp(t, T0, epsilon, om, fi) if temp is None else temp(t)
+        return Viral(self.a.reshape((-1,) + (1,)*np.ndim(current_temp)),
+                     self.b.reshape((-1,) + (1,)*np.ndim(current_temp)), current_temp)
+
+    def rhs(self, X, t, T0, epsilon, om, fi, temp = None):
+        '''
+        Right-hand side in the layout of self.labels. X has shape (size,) or
+        (size, N) for N states at once; the signature matches odeint().
+        '''
+        R, I, V = self._split(np.asarray(X, dtype = float))
+        w = self.decay(t, T0, epsilon, om, fi, temp)
+        if V.ndim > 1 and np.ndim(w) == 1:
+            w = w[:, None]
+
+        Itot = self.A @ I
+        L = self.beta_d*Itot + self.beta_i*V
+        inc = R[self.hist]*self.s.reshape((-1,) + (1,)*(R.ndim - 1))*(self.GI @ I + self.GV @ V)
+
+        dR = -(self.d + self.d_recovered.reshape((-1,) + (1,)*(R.ndim - 1)))*R
+        dR[1:] -= self.eta*R[1:]
+        dR[0] += self.lambd + self.eta*R[1:].sum(axis = 0) - R[0]*L.sum(axis = 0)
+        dR[1:] -= (self.Hp @ inc)[1:]
+        dR += self.gamma*(self.Rec @ I)
+
+        rate = self.gamma + self.d + self.d_strain[self.strain]
+        dI = inc - rate.reshape((-1,) + (1,)*(I.ndim - 1))*I
+        dV = self.p.reshape((-1,) + (1,)*(V.ndim - 1))*Itot - w*V
+
+        return np.concatenate([dR, dI, dV])
+
+    def jacobian(self, X, t, T0, epsilon, om, fi, temp = None):
+        '''Exact Jacobian of rhs() of shape (size, size) for a single state X.'''
+        H, P, n = self.H, self.P, self.n
+        R, I, V = self._split(np.asarray(X, dtype = float))
+        w = self.decay(t, T0, epsilon, om, fi, temp)
+
+        G = self.GI @ I + self.GV @ V
+        Rh = R[self.hist]*self.s
+        d_inc = np.hstack([self.Hp.T*(self.s*G)[:, None], Rh[:, None]*self.GI, Rh[:, None]*self.GV])
+
+        J = np.zeros((self.size, self.size))
+        rR, rI, rV = slice(0, H), slice(H, H + P), slice(H + P, None)
+
+        J[rR, rR] = -np.diag(self.d + self.d_recovered)
+        J[np.arange(1, H), np.arange(1, H)] -= self.eta
+        J[0, 1:H] += self.eta
+        J[1:H] -= (self.Hp @ d_inc)[1:]
+        J[rR, rI] += self.gamma*self.Rec
+
+        # naive hosts lose at the total force of infection
+        L = self.beta_d*(self.A @ I) + self.beta_i*V
+        J[0, 0] -= L.sum()
+        J[0, rI] -= R[0]*self.beta_d*self.A.sum(axis = 0)
+        J[0, rV] -= R[0]*self.beta_i
+
+        J[rI] = d_inc
+        J[rI, rI] -= np.diag(self.gamma + self.d + self.d_strain[self.strain])
+
+        J[rV, rI] = self.p[:, None]*self.A
+        J[rV, rV] = -np.diag(w)
+        return J
+
+    def next_generation(self, t, T0, epsilon, om, fi, temp = None):
+        '''
+        New-infection matrix F and transition matrix V at the disease-free state
+        S* = lambd/d for the infected subsystem [I_{}1 ... I_{}n, V1 ... Vn]
+        (only naive hosts exist there). t may be an array; the matrices then
+        have shape t.shape + (2n, 2n).
+        '''
+        n = self.n
+        naive = self.hist == 0
+        S = self.lambd/self.d
+        w = np.moveaxis(np.asarray(self.decay(t, T0, epsilon, om, fi, temp)), 0, -1)
+
+        F = np.zeros((2*n, 2*n))
+        F[:n, :n] = S*self.GI[np.ix_(naive, naive)]
+        F[:n, n:] = S*self.GV[naive]
+
+        V = np.zeros(w.shape[:-1] + (2*n, 2*n))
+        V[..., :n, :n] = np.diag(self.gamma + self.d + self.d_strain)
+        V[..., n:, :n] = -np.diag(self.p)
+        V[..., n + np.arange(n), n + np.arange(n)] = w
+        return F, V
+
+    def R0(self, t, T0, epsilon, om, fi, temp = None):
+        '''
+        Basic reproduction number at the temperature of time t, the spectral
+        radius of F V^-1; vectorized over an array t.
+        '''
+        F, V = self.next_generation(t, T0, epsilon, om, fi, temp)
+        K = F @ np.linalg.inv(V)
+        return np.max(np.abs(np.linalg.eigvals(K)), axis = -1)
+
+    def Ri(self, T0, epsilon, om, fi, temp = None, n_steps = 730, tol = 1e-8):
+        '''
+        Invasion threshold under periodic temperature: the theta for which the
+        monodromy matrix of dw/dt = (-V(t) + F/theta) w has spectral radius
+        one, with the monodromy matrix from piecewise matrix exponentials as in
+        RiTwoStrain.monodromy_expm().
+        '''
+        from scipy.linalg import expm
+        from scipy.optimize import brentq
+
+        period = 2*np.pi/om
+        h = period/n_steps
+        t_mid = (np.arange(n_steps) + 0.5)*h
+        F, V = self.next_generation(t_mid, T0, epsilon, om, fi, temp)
+
+        def g(log_theta):
+            E = expm((-V + F/np.exp(log_theta))*h)
+            W = E[0]
+            for Ek in E[1:]:
+                W = Ek @ W
+            return np.log(np.max(np.abs(np.linalg.eigvals(W))))
+
+        # log(rho) decreases in theta; bracket around the mean R0 over the period
+        x = np.log(np.mean(self.R0(t_mid, T0, epsilon, om, fi, temp)))
+        lo, hi = x - 1, x + 1
+        while g(lo) < 0:
+            lo -= 2
+        while g(hi) > 0:
+            hi += 2
+        return np.exp(brentq(g, lo, hi, xtol = tol))
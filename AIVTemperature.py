@@ -0,0 +1,125 @@
+import numpy as np
+
+from AIVDynamics import Viral
+
+
+class TemperatureSeries:
+    '''
+    Measured temperatures on a uniform time grid, to drive Avian(), R0_calc
+    and RiTwoStrain instead of the sinusoid Temp(). Pass an instance as
+    temp = series; the T0, epsilon, om and fi arguments are then ignored for
+    the temperature.
+    Lookups are linear interpolation on the uniform grid, so their cost does
+    not depend on the length of the series. The viral decay rates Viral(a, b,
+    T) are tabulated on the same grid the first time a pair (a, b) is used,
+    so the right-hand side interpolates them instead of evaluating exp.
+    A series loaded from an .npy file is memory mapped; pickling it (e.g. to
+    worker processes) only sends the path, and every process maps the same file.
+    Parameters
+    ----------
+    values : array
+        Temperatures of shape (n_time,) or (n_time, n_sites) for several sites.
+    t0 : scalar
+        Time of the first value in days. The default is 0.
+    dt : scalar
+        Spacing of the values in days. The default is 1.
+    periodic : bool
+        Repeat the series outside its range (e.g. for a climatological year);
+        otherwise the first and last values are held. The default is False.
+    '''
+
+    def __init__(self, values, t0 = 0, dt = 1, periodic = False):
+        self.values = values if isinstance(values, np.memmap) else np.asarray(values, dtype = float)
+        if len(self.values) < 2:
+            raise ValueError("A temperature series needs at least two values.")
+        self.t0 = float(t0)
+        self.dt = float(dt)
+        self.periodic = periodic
+        self._decay = {}
+
+    @classmethod
+    def from_csv(cls, path, time_col = 0, temp_col = 1, skiprows = 1, delimiter = ',',
+                 dt = None, periodic = False):
+        '''
+        Read times (days) and temperatures from two columns of a CSV file.
+        Irregular or gappy records are resampled to a uniform grid with step
+        dt (the default is the median spacing of the record).
+        '''
+        t, T = np.loadtxt(path, delimiter = delimiter, skiprows = skiprows,
+                          usecols = (time_col, temp_col), unpack = True)
+        return cls.from_samples(t, T, dt = dt, periodic = periodic)
+
+    @classmethod
+    def from_samples(cls, t, T, dt = None, periodic = False):
+        '''
+        Series from arbitrary times t (days) and temperatures T of shape
+        (len(t),) or (len(t), n_sites), resampled to a uniform grid of step dt
+        (the default is the median spacing of t).
+        '''
+        t = np.asarray(t, dtype = float)
+        T = np.asarray(T, dtype = float)
+        order = np.argsort(t)
+        t, T = t[order], T[order]
+        if dt is None:
+            dt = np.median(np.diff(t))
+        grid = t[0] + dt*np.arange(int(round((t[-1] - t[0])/dt)) + 1)
+        if T.ndim == 1:
+            values = np.interp(grid, t, T)
+        else:
+            values = np.stack([np.interp(grid, t, T[:, j]) for j in range(T.shape[1])], axis = 1)
+        return cls(values, t[0], dt, periodic)
+
+    @classmethod
+    def load(cls, path, t0 = 0, dt = 1, periodic = False):
+        '''Memory map the temperatures stored in an .npy file, see save().'''
+        return cls(np.load(path, mmap_mode = 'r'), t0, dt, periodic)
+
+    def save(self, path):
+        '''Write the temperatures to an .npy file that load() can memory map.'''
+        np.save(path, self.values)
+
+    def __getstate__(self):
+        state = dict(self.__dict__, _decay = {})
+        if isinstance(self.values, np.memmap):
+            state['values'] = ('memmap', self.values.filename)
+        return state
+
+    def __setstate__(self, state):
+        if isinstance(state['values'], tuple):
+            state['values'] = np.load(state['values'][1], mmap_mode = 'r')
+        self.__dict__.update(state)
+
+    def _interp(self, table, t):
+        n = len(table)
+        x = (np.asarray(t, dtype = float) - self.t0)/self.dt
+        if self.periodic:
+            x = np.mod(x, n)
+            i = np.floor(x).astype(int)
+            j = (i + 1) % n
+        else:
+            x = np.clip(x, 0, n - 1)
+            i = np.minimum(np.floor(x).astype(int), n - 2)
+            j = i + 1
+        f = x - i
+        if table.ndim > 1:
+            f = f[..., None]
+        return table[i]*(1 - f) + table[j]*f
+
+    def __call__(self, t):
+        '''
+        Temperature at time t (scalar or array), with shape t.shape or
+        t.shape + (n_sites,).
+        '''
+        return self._interp(self.values, t)
+
+    def decay(self, a, b, t):
+        '''
+        Viral(a, b, T(t)) from a precomputed table. Arrays of a or b (ensembles)
+        are not tabulated and evaluate Viral() on the interpolated temperature.
+        '''
+        if np.ndim(a) or np.ndim(b):
+            return Viral(a, b, self(t))
+        key = (float(a), float(b))
+        if key not in self._decay:
+            self._decay[key] = Viral(a, b, np.asarray(self.values))
+        return self._interp(self._decay[key], t)
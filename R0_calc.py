@@ -48,10 +48,185 @@ def Viral(a, b, Temp):
     return Viral
 
    
+def R0Components(t, a, b, T0, epsilon, fi, om, fit = 1, beta_d = 2.3e-9, beta_i = 3.55e-9,
+                 p1 = 1e3, p2 = 1e4, gamma = 0.24, d = 0.1/365, d2 = 0.88,
+                 alpha1 = 0.065, alpha2 = 0.065, temp = None):
+    '''
+    Same quantities as R0() without plotting. Every argument may be an array;
+    all of them are broadcast against each other.
+    Parameters
+    ----------
+    t, a, b, T0, epsilon, fi, om : scalar or array
+    See R0().
+    fit : scalar or array, optional
+    Factor applied to beta_d and beta_i of HPAI (fit value). The default is 1.
+    beta_d, beta_i, p1, p2, gamma, d, d2, alpha1, alpha2 : scalar or array, optional
+    See R0().
+    temp : callable, optional
+    Measured temperature source temp(t) replacing Temp(), e.g. an
+    AIVTemperature.TemperatureSeries. The default is None.
+
+    Returns
+    -------
+    A : array
+        R0 for LPAI.
+    B : array
+        R0 for HPAI.
+    R0 : array
+        R0 for the coexisting environment.
+    '''
+    if temp is None:
+        current_temp = Temp(t, T0, epsilon, om, fi)
+        w1, w2 = Viral(0.114, 3.7594, current_temp), Viral(a, b, current_temp)
+    elif hasattr(temp, 'decay'):
+        w1, w2 = temp.decay(0.114, 3.7594, t), temp.decay(a, b, t)
+    else:
+        current_temp = temp(t)
+        w1, w2 = Viral(0.114, 3.7594, current_temp), Viral(a, b, current_temp)
+    S_star = 2 / d
+    
+    A = S_star * (beta_d / (gamma + d) + (beta_i * p1) / (w1 * (gamma + d)))
+    B = S_star * fit * (beta_d / (gamma + d + d2) + (beta_i * p2) / (w2 * (gamma + d + d2)))
+    term1 = (1 - alpha1) * A + (1 - alpha2) * B
+    term2 = (1 - alpha2) * A + (1 - alpha1) * B
+    disc = term2**2 - 4 * (1 - alpha1) * (1 - alpha2) * A * B
+
+    R0 = 0.5 * (term1 + np.sqrt(np.maximum(disc, 0)))  
+    
+    return A, B, R0
+
+
+def R0Grid(a, b, fit = 1, T0 = 5.73, epsilon = 1.91, t = 0, fi = 92.3, om = 2*np.pi/365,
+           chunk_size = 2**20, out = None, **kwargs):
+    '''
+    LPAI, HPAI and coexistence R0 on an N-dimensional parameter grid.
+    The inputs are broadcast against each other, so a grid is described by
+    giving each axis its own dimension, e.g. a[:, None, None], b[None, :, None]
+    and fit[None, None, :]. Grids with more than chunk_size points are
+    evaluated chunk by chunk over the flattened grid, which bounds the memory
+    of the temporaries; pass np.memmap arrays as out if the result itself
+    should not be held in memory.
+    Parameters
+    ----------
+    a, b, fit, T0, epsilon, t, fi, om : scalar or array
+    See R0Components().
+    chunk_size : int, optional
+    Maximum number of grid points evaluated at once. The default is 2**20.
+    out : tuple of three arrays, optional
+    Arrays of the broadcast shape to write A, B and R0 into.
+    **kwargs : optional
+    Other parameters of R0Components(), scalar or broadcastable arrays, and
+    a temperature source temp.
+
+    Returns
+    -------
+    A, B, R0 : arrays
+        Arrays of the broadcast shape of all inputs.
+    '''
+    temp = kwargs.pop('temp', None)
+    inputs = {'t': t, 'a': a, 'b': b, 'T0': T0, 'epsilon': epsilon, 'fi': fi, 'om': om,
+              'fit': fit, **kwargs}
+    inputs = {k: np.asarray(v, dtype = float) for k, v in inputs.items()}
+    shape = np.broadcast_shapes(*(v.shape for v in inputs.values()))
+    size = int(np.prod(shape))
+
+    if out is None:
+        out = tuple(np.empty(shape) for _ in range(3))
+
+    if size <= chunk_size:
+        for o, r in zip(out, R0Components(**inputs, temp = temp)):
+            o[...] = r
+        return out
+
+    full = {k: np.broadcast_to(v, shape) for k, v in inputs.items()}
+    flat = [o.reshape(-1) for o in out]
+    for start in range(0, size, chunk_size):
+        idx = np.unravel_index(np.arange(start, min(start + chunk_size, size)), shape)
+        chunk = R0Components(**{k: v[idx] for k, v in full.items()}, temp = temp)
+        for o, r in zip(flat, chunk):
+            o[start:start + len(r)] = r
+    return out
+
+
+def R0Threshold(b, levels, fit = 1, which = 'HPAI', a_range = (0, 1), T0 = 5.73,
+                epsilon = 1.91, t = 0, fi = 92.3, om = 2*np.pi/365, tol = 1e-10, **kwargs):
+    '''
+    Threshold curve R0(a, b) = level solved for the HPAI decay slope a.
+    For every b (and every level and fit value, all broadcast against each
+    other) the a on the boundary is returned directly, so a curve with n
+    points costs O(n) instead of contouring an n x n grid. The HPAI R0 is
+    solved in closed form; the coexistence R0 is increasing in the HPAI R0
+    and is solved by bisection on a, vectorized over all points at once.
+    The LPAI R0 does not depend on a or b and has no threshold curve.
+    Parameters
+    ----------
+    b : scalar or array
+    Intercepts of the HPAI viral decay.
+    levels : scalar or array
+    Threshold values of R0.
+    fit : scalar or array, optional
+    Factor applied to beta_d and beta_i of HPAI. The default is 1.
+    which : str, optional
+    'HPAI' (default) or 'coexistence'.
+    a_range : tuple, optional
+    Interval of a in which the curve is sought. The default is (0, 1).
+    T0, epsilon, t, fi, om : scalar
+    Temperature at which R0 is evaluated, see R0().
+    tol : scalar, optional
+    Absolute tolerance on a for the bisection. The default is 1e-10.
+    **kwargs : optional
+    Other parameters of R0Components().
+
+    Returns
+    -------
+    a : array
+        Values of a on the threshold curve, of the broadcast shape of b, levels
+        and fit. NaN where the curve does not exist (or leaves a_range).
+    '''
+    b, levels, fit = (np.asarray(x, dtype = float) for x in (b, levels, fit))
+    args = dict(T0 = T0, epsilon = epsilon, fi = fi, om = om, **kwargs)
+
+    if which == 'HPAI':
+        temp = kwargs.get('temp')
+        current_temp = Temp(t, T0, epsilon, om, fi) if temp is None else temp(t)
+
+        # B = P + Q/Viral(a, b, T) is affine in 1/Viral; read P and Q off R0Components
+        P = R0Components(t, 0, b, fit = fit, **{**args, 'beta_i': 0})[1]
+        Q = (R0Components(t, 0, b, fit = fit, **args)[1] - P) * Viral(0, b, current_temp)
+
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            decay = Q / (levels - P)
+            a = (np.log(decay / np.log(10)) + b) / current_temp
+        inside = (decay > 0) & (a >= a_range[0]) & (a <= a_range[1])
+        return np.where(inside, a, np.nan)
+
+    if which != 'coexistence':
+        raise ValueError(f"Unknown R0 {which!r}, expected 'HPAI' or 'coexistence'.")
+
+    def g(a):
+        return R0Components(t, a, b, fit = fit, **args)[2] - levels
+
+    shape = np.broadcast_shapes(b.shape, levels.shape, fit.shape)
+    lo = np.full(shape, float(a_range[0]))
+    hi = np.full(shape, float(a_range[1]))
+    g_lo = g(lo)
+    valid = np.sign(g_lo) != np.sign(g(hi))
+
+    for _ in range(int(np.ceil(np.log2((a_range[1] - a_range[0]) / tol)))):
+        mid = 0.5 * (lo + hi)
+        g_mid = g(mid)
+        left = np.sign(g_mid) == np.sign(g_lo)
+        lo = np.where(left, mid, lo)
+        g_lo = np.where(left, g_mid, g_lo)
+        hi = np.where(left, hi, mid)
+
+    return np.where(valid, 0.5 * (lo + hi), np.nan)
+
+
 # Define A and B
 def R0(t, a, b, T0, epsilon, fi, om, beta_d = 2.3e-9, beta_i = 3.55e-9, p1 = 1e3, 
        p2 = 1e4, gamma = 0.24, d = 0.1/365, d2 = 0.88,
-       alpha1 = 0.065, alpha2 = 0.065):
+       alpha1 = 0.065, alpha2 = 0.065, temp = None):
     '''
     Parameters
     ----------
@@ -87,6 +262,8 @@ def R0(t, a, b, T0, epsilon, fi, om, beta_d = 2.3e-9, beta_i = 3.55e-9, p1 = 1e3
     Mutation rate from LPAI to HPAI. The default is 0.065.
     alpha2 : scalar, optional
     Mutation rate from HPAI to LPAI. The default is 0.065.
+    temp : callable, optional
+    Measured temperature source replacing Temp(), see R0Components(). The default is None.
 
     Returns
     -------
@@ -94,16 +271,10 @@ def R0(t, a, b, T0, epsilon, fi, om, beta_d = 2.3e-9, beta_i = 3.55e-9, p1 = 1e3
         The time-invariant basic reproduction number for both viruses 
 
     '''
-    current_temp = Temp(t, T0, epsilon, om, fi)
-    S_star = 2 / d
-    
-    A = S_star * (beta_d / (gamma + d) + (beta_i * p1) / (Viral(0.114, 3.7594, current_temp) * (gamma + d)))
-    B = S_star * (beta_d / (gamma + d + d2) + (beta_i * p2) / (Viral(a, b, current_temp) * (gamma + d + d2)))
-    term1 = (1 - alpha1) * A + (1 - alpha2) * B
-    term2 = (1 - alpha2) * A + (1 - alpha1) * B
-    disc = term2**2 - 4 * (1 - alpha1) * (1 - alpha2) * A * B
-
-    R0 = 0.5 * (term1 + np.sqrt(np.maximum(disc, 0)))  
+    current_temp = Temp(t, T0, epsilon, om, fi) if temp is None else temp(t)
+    A, B, R0 = R0Components(t, a, b, T0, epsilon, fi, om, beta_d = beta_d, beta_i = beta_i,
+                            p1 = p1, p2 = p2, gamma = gamma, d = d, d2 = d2,
+                            alpha1 = alpha1, alpha2 = alpha2, temp = temp)
     
     import matplotlib.pyplot as plt 
     
@@ -1,11 +1,14 @@
 import numpy as np
 from scipy.integrate import solve_ivp
+from scipy.linalg import expm
 
 t = np.linspace(0, 365, 366)
 omega = 2*np.pi/365
 
-def T(t):
-    return 5.73 * (1 + 1.91 * np.sin(omega * t + 92.3))
+# Default temperature and strain parameters
+T0 = 5.73
+epsilon = 1.91
+fi = 92.3
 
 gamma = 0.1
 p_2 = 1e4
@@ -18,92 +21,459 @@ alpha = 0.065
 beta_d1 = 2.14e-9
 beta_i1 = 3.55e-9
 
-def Omega_2(temp):
-    return np.log(10) * np.exp(0.0587 * temp - 3.6348)
+a = 0.0587
+b = 3.6348
+
+def T(t, T0 = T0, epsilon = epsilon, om = omega, fi = fi):
+    return T0 * (1 + epsilon * np.sin(om * t + fi))
+
+def Omega_2(temp, a = a, b = b):
+    return np.log(10) * np.exp(a * temp - b)
 
 def Omega_1(temp):
     return np.log(10) * np.exp(0.114*temp -  3.7594)
 
-def V_t(t):
-    temp = T(t)
-    Omega1 = Omega_1(temp)
-    Omega2 = Omega_2(temp)
-    return np.array([
-        [gamma + d, 0, 0, 0],
-        [0, gamma + d1, 0, 0],
-        [-p_1, 0, Omega1, 0],
-        [0, -p_2, 0, Omega2]
+def system(T0 = T0, epsilon = epsilon, om = omega, fi = fi, a = a, b = b,
+           gamma = gamma, p_1 = p_1, p_2 = p_2, d = d, d1 = d1, Lambda = Lambda,
+           alpha = alpha, beta_d1 = beta_d1, beta_i1 = beta_i1, temp = None):
+    '''
+    Build the linearised invasion system at the disease-free state.
+
+    Parameters
+    ----------
+    T0, epsilon, om, fi : scalar
+        Temperature T(t) = T0 * (1 + epsilon * sin(om * t + fi)).
+    a, b : scalar
+        Slope and intercept of the HPAI viral decay rate.
+    gamma, p_1, p_2, d, d1, Lambda, alpha, beta_d1, beta_i1 : scalar
+        Recovery, shedding (LPAI, HPAI), natural death, HPAI death, birth,
+        mutation, direct and indirect transmission rates.
+    temp : callable, optional
+        Measured temperature source temp(t) replacing T(), e.g. an
+        AIVTemperature.TemperatureSeries with periodic=True covering one
+        period 2*pi/om. The default is None.
+
+    Returns
+    -------
+    V_t : function
+        V_t(t) returns the 4x4 transition matrix at time t.
+    F_t : array
+        4x4 new-infection matrix.
+    period : scalar
+        Period 2*pi/om of the temperature forcing.
+    '''
+    def V_t(t):
+        if temp is None:
+            current = T(t, T0, epsilon, om, fi)
+            Omega1, Omega2 = Omega_1(current), Omega_2(current, a, b)
+        elif hasattr(temp, 'decay'):
+            Omega1, Omega2 = temp.decay(0.114, 3.7594, t), temp.decay(a, b, t)
+        else:
+            current = temp(t)
+            Omega1, Omega2 = Omega_1(current), Omega_2(current, a, b)
+        return np.array([
+            [gamma + d, 0, 0, 0],
+            [0, gamma + d1, 0, 0],
+            [-p_1, 0, Omega1, 0],
+            [0, -p_2, 0, Omega2]
+        ], dtype=float)
+
+    Sstar = Lambda / d
+
+    F_t = np.array([
+        [alpha* beta_d1 * Sstar,  (1-alpha)* beta_d1 * Sstar, alpha* beta_i1 * Sstar, (1-alpha)* beta_i1 * Sstar],
+        [(1-alpha)* beta_d1 * Sstar, alpha* beta_d1 * Sstar, (1-alpha)* beta_i1 * Sstar, alpha* beta_i1 * Sstar],
+        [0, 0, 0, 0],
+        [0, 0, 0, 0]
     ], dtype=float)
 
-Sstar = Lambda / d
-
-F_t = np.array([
-    [alpha* beta_d1 * Sstar,  (1-alpha)* beta_d1 * Sstar, alpha* beta_i1 * Sstar, (1-alpha)* beta_i1 * Sstar],
-    [(1-alpha)* beta_d1 * Sstar, alpha* beta_d1 * Sstar, (1-alpha)* beta_i1 * Sstar, alpha* beta_i1 * Sstar],
-    [0, 0, 0, 0],
-    [0, 0, 0, 0]
-], dtype=float)
-
-def dwdt(t, w, theta):
-    V = V_t(t)
-    A = (-V + F_t / theta)
-    return A @ w
-
-def solver(w0, theta):
-    sol = solve_ivp(
-        lambda tt, ww: dwdt(tt, ww, theta),
-        (0.0, 365.0),
-        w0,
-        method="BDF",
-        max_step=1.0
-    )
+    return V_t, F_t, 2*np.pi/om
+
+def monodromy(theta, **params):
+    '''
+    Monodromy matrix W(period) of dw/dt = (-V(t) + F/theta) w.
+
+    All four columns are integrated together as one matrix ODE
+    dW/dt = A(t) W, W(0) = I, so a single BDF solve replaces one solve per
+    basis vector.
+
+    Parameters
+    ----------
+    theta : scalar
+        Scaling of the new-infection matrix.
+    **params : optional
+        Temperature and strain parameters passed to system().
+
+    Returns
+    -------
+    W : array
+        4x4 monodromy matrix.
+    '''
+    V_t, F_t, period = system(**params)
+    I = np.eye(4)
+
+    def A(t):
+        return -V_t(t) + F_t / theta
+
+    def dWdt(t, w):
+        return (A(t) @ w.reshape(4, 4)).ravel()
+
+    def jac(t, w):
+        # d vec(A W) / d vec(W) for row-major vec
+        return np.kron(A(t), I)
+
+    # tight tolerances keep the spectral radius smooth in theta for the root finders
+    sol = solve_ivp(dWdt, (0.0, period), I.ravel(), method="BDF",
+                    jac=jac, max_step=1.0, rtol=1e-6, atol=1e-9)
     if not sol.success:
         raise RuntimeError(sol.message)
-    return sol.y[:, -1]
+    return sol.y[:, -1].reshape(4, 4)
 
-Y = np.eye(4)
+def _expm_product(theta, n_steps, **params):
+    V_t, F_t, period = system(**params)
+    h = period / n_steps
+    t_mid = (np.arange(n_steps) + 0.5) * h
 
-def f(theta):
-    W = np.zeros((4, 4))
-    for i in range(4):
-        w0 = Y[:, i]                 # use columns (basis vectors)
-        W[:, i] = solver(w0, theta)  # column i of monodromy matrix
+    # A_k(theta) = -V(t_k) + F/theta for every step and every theta
+    V = np.array([V_t(tk) for tk in t_mid])
+    A = -V[:, None] + F_t / theta[None, :, None, None]
+    E = expm(A * h)
+
+    # ordered product E_{n-1} ... E_1 E_0, reduced pairwise
+    while len(E) > 1:
+        if len(E) % 2:
+            E = np.concatenate([E[:-2], (E[-1] @ E[-2])[None]])
+        E = E[1::2] @ E[0::2]
+    return E[0]
+
+def monodromy_expm(theta, n_steps=730, error=None, **params):
+    '''
+    Monodromy matrix of dw/dt = (-V(t) + F/theta) w from piecewise matrix
+    exponentials.
+
+    The period is split into n_steps equal steps, V is frozen at the midpoint
+    of each step and the exact propagators expm(A_k h) are multiplied
+    together. This is second order in the step size and needs no adaptive
+    solver; all values of theta are handled in one vectorized pass.
+
+    Parameters
+    ----------
+    theta : scalar or array
+        Scaling(s) of the new-infection matrix.
+    n_steps : int
+        Number of steps per period. The default is 730 (half a day).
+    error : str, optional
+        "richardson" also returns the error of each spectral radius estimated
+        from a second product with n_steps // 2 steps; "ode" returns the
+        difference to the spectral radius of monodromy() (one ODE solve per
+        theta). The default is None.
+    **params : optional
+        Temperature and strain parameters passed to system().
+
+    Returns
+    -------
+    W : array
+        Monodromy matrices of shape theta.shape + (4, 4).
+    err : array
+        Only if error is given, relative error of the spectral radius for each theta.
+    '''
+    theta = np.asarray(theta, dtype=float)
+    W = _expm_product(theta.ravel(), n_steps, **params)
+    W = W.reshape(theta.shape + (4, 4))
+
+    if error is None:
+        return W
+
+    rho = np.max(np.abs(np.linalg.eigvals(W)), axis=-1)
+    if error == "richardson":
+        W2 = _expm_product(theta.ravel(), n_steps // 2, **params).reshape(W.shape)
+        rho2 = np.max(np.abs(np.linalg.eigvals(W2)), axis=-1)
+        # second order: the error with n_steps is a third of the difference
+        err = np.abs(rho - rho2) / 3 / rho
+    elif error == "ode":
+        rho_ode = np.array([np.max(np.abs(np.linalg.eigvals(monodromy(th, **params))))
+                            for th in theta.ravel()]).reshape(theta.shape)
+        err = np.abs(rho - rho_ode) / rho_ode
+    else:
+        raise ValueError(f"Unknown error estimate {error!r}, expected 'richardson' or 'ode'.")
+    return W, err
+
+def f(theta, engine="ode", **params):
+    if engine == "expm":
+        W = monodromy_expm(theta, **params)
+    else:
+        W = monodromy(theta, **params)
 
     eigvals = np.linalg.eigvals(W)
     spec_rad = np.max(np.abs(eigvals))   # spectral radius
     return spec_rad - 1.0
 
-def find_theta(theta_low = 1, theta_high=5.0, tol=1e-6, max_expand=60, max_iter=80):
-    f_low = f(theta_low)
-    f_high = f(theta_high)
+def find_theta(theta_low = 1, theta_high=5.0, tol=1e-6, max_expand=60, max_iter=80,
+               method="brentq", full_output=False, **params):
+    '''
+    Find the theta at which the spectral radius of the monodromy matrix is one.
+
+    Parameters
+    ----------
+    theta_low, theta_high : scalar
+        Initial bracket. A caller that knows a nearby threshold (e.g. from a
+        neighbouring parameter set) can pass a tight bracket around it; the
+        bracket is widened until f changes sign.
+    tol : scalar
+        Absolute tolerance on theta.
+    max_expand : int
+        Maximum number of bracket expansions.
+    max_iter : int
+        Maximum number of root-finding iterations.
+    method : str
+        "brentq" (default), "secant" or "bisect". f is smooth and monotone in
+        theta, so Brent's method typically needs 6 to 10 evaluations where
+        bisection needs 20 or more.
+    full_output : bool
+        Also return a dict with the method and the number of evaluations of f.
+    **params : optional
+        Temperature and strain parameters passed to system().
+
+    Returns
+    -------
+    theta : scalar
+    '''
+    from scipy.optimize import brentq, root_scalar
+
+    nfev = 0
 
-    # Expand upper bound until sign change
+    def g(theta):
+        nonlocal nfev
+        nfev += 1
+        return f(theta, **params)
+
+    f_low = g(theta_low)
+    f_high = g(theta_high)
+
+    # Expand the bracket until sign change. f decreases with theta, so move
+    # the upper bound up while both values are positive and the lower bound
+    # down while both are negative.
     k = 0
     while f_low * f_high > 0 and k < max_expand:
-        theta_high *= 2.0
-        f_high = f(theta_high)
+        if f_high > 0:
+            theta_low, f_low = theta_high, f_high
+            theta_high *= 2.0
+            f_high = g(theta_high)
+        else:
+            theta_high, f_high = theta_low, f_low
+            theta_low *= 0.5
+            f_low = g(theta_low)
         k += 1
-    
-    # Warning if there is no root 
+
+    # Warning if there is no root
     if f_low * f_high > 0:
         raise RuntimeError("Could not bracket root: f(theta_low) and f(theta_high) have same sign.")
 
-    # Bisection method 
-    for _ in range(max_iter):
-        theta_mid = 0.5 * (theta_low + theta_high)
-        f_mid = f(theta_mid)
+    # The spectral radius scales roughly like 1/theta, so log(spectral radius)
+    # is close to linear in log(theta) and the interpolating methods below
+    # converge in a few steps on that scale.
+    def h(x):
+        return np.log1p(g(np.exp(x)))
+
+    if method == "brentq":
+        x = brentq(h, np.log(theta_low), np.log(theta_high),
+                   xtol=tol / theta_high, maxiter=max_iter)
+        theta = float(np.exp(x))
+
+    elif method == "secant":
+        sol = root_scalar(h, method="secant", x0=np.log(theta_low), x1=np.log(theta_high),
+                          xtol=tol / theta_high, maxiter=max_iter)
+        if not sol.converged:
+            raise RuntimeError(sol.flag)
+        theta = float(np.exp(sol.root))
+
+    elif method == "bisect":
+        for _ in range(max_iter):
+            theta = 0.5 * (theta_low + theta_high)
+            f_mid = g(theta)
+
+            if abs(f_mid) < 1e-10 or (theta_high - theta_low) < tol:
+                break
+
+            if f_mid > 0:
+                theta_low = theta
+            else:
+                theta_high = theta
+
+    else:
+        raise ValueError(f"Unknown method {method!r}, expected 'brentq', 'secant' or 'bisect'.")
+
+    if full_output:
+        return theta, {"method": method, "nfev": nfev}
+    return theta
 
-        if abs(f_mid) < 1e-10 or (theta_high - theta_low) < tol:
-            return theta_mid
+def Ri(T0 = T0, epsilon = epsilon, om = omega, fi = fi, a = a, b = b, **kwargs):
+    '''
+    Invasion threshold R_i of the two-strain model.
 
-        if f_mid > 0:
-            theta_low = theta_mid
+    R_i is the value of theta for which the spectral radius of the
+    monodromy matrix of dw/dt = (-V(t) + F/theta) w equals one.
+
+    Parameters
+    ----------
+    T0, epsilon, om, fi : scalar
+        Temperature T(t) = T0 * (1 + epsilon * sin(om * t + fi)).
+    a, b : scalar
+        Slope and intercept of the HPAI viral decay rate.
+    **kwargs : optional
+        Strain parameters of system() (gamma, p_1, p_2, d, d1, Lambda, alpha,
+        beta_d1, beta_i1) and root-finding options of find_theta()
+        (theta_low, theta_high, tol, max_expand, max_iter, method, full_output).
+
+    Returns
+    -------
+    R_i : scalar
+    '''
+    return find_theta(T0=T0, epsilon=epsilon, om=om, fi=fi, a=a, b=b, **kwargs)
+
+# options of find_theta() and monodromy_expm() that do not change the threshold;
+# engine and n_steps do and are part of the key
+_SOLVER_OPTIONS = ("theta_low", "theta_high", "tol", "max_expand", "max_iter", "method",
+                   "full_output", "error")
+
+def _cache_key(params):
+    '''
+    Parameters of a sweep point as a JSON-able dict: the defaults of system()
+    filled in, the engine (with its n_steps for "expm"), root-finding options
+    left out, numbers as floats and a temperature series by a hash of its
+    contents.
+    '''
+    import hashlib
+    import inspect
+
+    defaults = {k: p.default for k, p in inspect.signature(system).parameters.items()}
+    defaults["engine"] = "ode"
+    if params.get("engine") == "expm":
+        defaults["n_steps"] = inspect.signature(monodromy_expm).parameters["n_steps"].default
+    else:
+        params = {k: v for k, v in params.items() if k != "n_steps"}
+    key = {}
+    for k, v in {**defaults, **params}.items():
+        if k in _SOLVER_OPTIONS:
+            continue
+        if v is None or isinstance(v, str):
+            key[k] = v
+        elif np.ndim(v) == 0 and not callable(v):
+            key[k] = float(v)
+        elif all(hasattr(v, attr) for attr in ("values", "t0", "dt", "periodic")):
+            values = np.ascontiguousarray(v.values, dtype=float)
+            digest = hashlib.sha256(str(values.shape).encode() + values.tobytes()).hexdigest()
+            key[k] = {"series": digest, "t0": float(v.t0), "dt": float(v.dt),
+                      "periodic": bool(v.periodic)}
         else:
-            theta_high = theta_mid
+            raise ValueError(f"Cannot cache R_i for {k} = {v!r}; only scalars, strings and "
+                             f"TemperatureSeries can be hashed. Pass cache_dir=None.")
+    return key
+
+def _cache_path(cache_dir, key):
+    import hashlib
+    import json
+    import os
+
+    digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+    return os.path.join(cache_dir, digest + ".json")
+
+def _sweep_line(points, cache_dir, kwargs):
+    '''
+    Compute R_i along one line of a sweep grid. Each point seeds the bracket
+    of the next one with its own threshold; the first point uses the bracket
+    of the caller, if any.
+    '''
+    import json
+    import os
+
+    out = []
+    theta = None
+    for point in points:
+        # the sweep keeps only the thresholds
+        params = {**point, **kwargs, "full_output": False}
+        key = _cache_key(params) if cache_dir is not None else None
+        path = _cache_path(cache_dir, key) if cache_dir is not None else None
+
+        if path is not None and os.path.exists(path):
+            with open(path) as fh:
+                theta = json.load(fh)["Ri"]
+            out.append(theta)
+            continue
+
+        bracket = {} if theta is None else {"theta_low": 0.9 * theta, "theta_high": 1.1 * theta}
+        try:
+            theta = Ri(**{**params, **bracket})
+        except RuntimeError:
+            theta = None
+            out.append(np.nan)
+            continue
+        out.append(theta)
+
+        if path is not None:
+            # write then rename, so an interrupted sweep never leaves a partial file
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as fh:
+                json.dump({"params": key, "Ri": theta}, fh)
+            os.replace(tmp, path)
+    return out
+
+def Ri_sweep(grid, cache_dir=None, processes=None, **kwargs):
+    '''
+    Invasion threshold R_i on a grid of temperature and strain parameters.
+
+    The grid is split into lines along its last axis. Lines are distributed
+    over a process pool, and within a line each point starts the root search
+    from a bracket around the threshold of its neighbour. With cache_dir set,
+    every result is stored in a file named by a hash of its parameters and
+    engine (not of the root-finding options), so an interrupted or extended
+    sweep only computes the missing points.
+
+    Parameters
+    ----------
+    grid : dict
+        Parameter name -> 1-D array of values, e.g.
+        {"T0": np.linspace(0, 20, 50), "epsilon": np.linspace(0, 2, 50)}.
+        Any argument of Ri() or system() can be swept.
+    cache_dir : str, optional
+        Directory of the on-disk cache. The default is None (no cache).
+    processes : int, optional
+        Number of worker processes. The default uses all cores; 1 runs serially.
+    **kwargs : optional
+        Parameters held fixed over the grid, and options of Ri(); full_output
+        is ignored.
+
+    Returns
+    -------
+    R_i : array
+        Array of shape (len(v) for v in grid.values()); NaN where no threshold
+        could be bracketed.
+    '''
+    import itertools
+    import os
+
+    names = list(grid)
+    values = [np.atleast_1d(np.asarray(grid[k], dtype=float)) for k in names]
+    shape = tuple(len(v) for v in values)
+
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+
+    lines = []
+    for head in itertools.product(*values[:-1]):
+        lines.append([dict(zip(names, head + (x,))) for x in values[-1]])
+
+    if processes == 1:
+        results = [_sweep_line(line, cache_dir, kwargs) for line in lines]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            results = list(pool.map(_sweep_line, lines,
+                                    itertools.repeat(cache_dir), itertools.repeat(kwargs)))
 
-    return f_mid
+    return np.array(results, dtype=float).reshape(shape)
 
-theta_star = find_theta()
-print("theta =", theta_star)
- 
- 
\ No newline at end of file
+if __name__ == "__main__":
+    theta_star = find_theta()
+    print("theta =", theta_star)
@@ -26,23 +26,15 @@ for i in fit:
     beta_d2 = i * beta_d1
     beta_i2 = i * beta_i1
     
-    # Initialize matrix
-    matrix = np.zeros((len(a), len(b)))
-    matrix2 = np.zeros((len(a), len(b)))
+    # Strand 1 does not depend on a or b
+    strand1 = (beta_d1 * Lambda) / (d * (gamma1 + d)) + (beta_i1 * Lambda * p1) / (d * Omega1 * (gamma1 + d))
     
-    # Calculate matrix values
-    for j in range(len(a)):
-        for k in range(len(b)):
-            # Calculate Omega2 for each a,b combination
-            Omega2 = a[j] * np.exp(-b[k] * average)
-            
-            # Calculate strand values
-            strand1 = (beta_d1 * Lambda) / (d * (gamma1 + d)) + (beta_i1 * Lambda * p1) / (d * Omega1 * (gamma1 + d))
-            strand2 = (beta_d2 * Lambda) / (d * (gamma2 + d)) + (beta_i2 * Lambda * p2) / (d * Omega2 * (gamma2 + d))
-            
-            # Store the strand values in their respective matrices
-            matrix[j, k] = strand1
-            matrix2[j, k] = strand2
+    # Calculate Omega2 on the whole (a, b) grid at once (rows: a, columns: b)
+    Omega2 = a[:, None] * np.exp(-b[None, :] * average)
+    
+    # Store the strand values in their respective matrices
+    matrix = np.full((len(a), len(b)), strand1)
+    matrix2 = (beta_d2 * Lambda) / (d * (gamma2 + d)) + (beta_i2 * Lambda * p2) / (d * Omega2 * (gamma2 + d))
     
     # Create the first heatmap
     #im1 = ax[0].imshow(matrix, origin='lower', aspect='auto', 
@@ -32,21 +32,11 @@ for idx, i in enumerate(fit):
     beta_d2 = i * beta_d1
     beta_i2 = i * beta_i1
     
-    # Initialize matrix for Strand 2
-    matrix2 = np.zeros((len(a), len(b)))
+    # Calculate Omega2 on the whole (a, b) grid at once (rows: a, columns: b)
+    Omega2 = a[:, None] * np.exp(b[None, :] * Temp)
     
-    # Calculate matrix values
-    for j in range(len(a)):
-        for k in range(len(b)):
-            # Calculate Omega2 for each a,b combination
-            Omega2 = a[j] * np.exp(b[k] * Temp)
-            
-            # Calculate strand values for Strand 2
-            strand1 = (beta_d1 * Lambda) / (d * (gamma1 + d)) + (beta_i1 * Lambda * p1) / (d * Omega1 * (gamma1 + d))
-            strand2 = (beta_d2 * Lambda) / (d * (gamma2 + d)) + (beta_i2 * Lambda * p2) / (d * Omega2 * (gamma2 + d))
-            
-            # Store the strand values in their respective matrix
-            matrix2[j, k] = strand2
+    # Calculate strand values for Strand 2
+    matrix2 = (beta_d2 * Lambda) / (d * (gamma2 + d)) + (beta_i2 * Lambda * p2) / (d * Omega2 * (gamma2 + d))
 
     
     # Create the heatmap for Strand 2 with the same color scale across all subplots
@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+from AIVDynamics import DynamicsSolver, EventSolver, PeriodicOrbit
+
+X0 = [7000, 10, 10, 0, 0, 0, 0, 0, 1e3, 1e3]
+ARGS = (0.06, 3.6, 10, 5)
+
+
+@pytest.mark.parametrize('om', [2*np.pi/365, 2*np.pi/365.2422, 0.0172])
+def test_periodic_stop_with_non_integer_period(om):
+    # start on the limit cycle at a time where t[0] + k*period is not exact in floats
+    orbit, _ = PeriodicOrbit(X0, *ARGS, om, 0)
+    t0 = 1000.0
+    X = DynamicsSolver(orbit[0], [0, t0], *ARGS, om, 0, plot = False)[-1]
+    t = t0 + np.arange(0, 365*5, 1.0)
+
+    t_out, res, info = EventSolver(X, t, *ARGS, om, 0, extinction = None)
+
+    period = 2*np.pi/om
+    assert info['reason'] == 'periodic'
+    assert info['t_event'] == pytest.approx(t0 + period)
+    assert t_out[-1] <= t0 + period
+    np.testing.assert_allclose(res[-1], DynamicsSolver(X, t_out, *ARGS, om, 0, plot = False)[-1],
+                               rtol = 1e-5)